@@ -43,14 +43,17 @@ try:
     import blib as ext_blib
 except ImportError:
     from .blib.exceptions import BlibException
+    from .blib.utils import BlibFile, ExportCache, source_hashes
 else:
     from . import blib as loc_blib
     loc_ver = loc_blib.utils.Version(loc_blib.__version__.split()[0])
     ext_ver = loc_blib.utils.Version(ext_blib.__version__.split()[0])
     if loc_ver >= ext_ver:
         from .blib.exceptions import BlibException
+        from .blib.utils import BlibFile, ExportCache, source_hashes
     else:
         from blib.exceptions import BlibException
+        from blib.utils import BlibFile, ExportCache, source_hashes
 
 def uniquify_name(filepath):
     num = 1
@@ -86,6 +89,16 @@ class ExportConfirmation(bpy.types.Operator):
         asset = getattr(context.scene.blib.assets, asset_type)
         assets = asset.assets
         
+        if context.scene.blib.bundle:
+            filepath = path.join(self.directory, "{}.blib".format(path.splitext(self.filename)[0]))
+            if path.isfile(filepath):
+                return context.window_manager.invoke_props_dialog(self)
+            return self.execute(context)
+        
+        #Existing files are expected in incremental exports, and are only written again if they changed
+        if context.scene.blib.incremental:
+            return self.execute(context)
+        
         for asset in assets:
             if asset.state == True:
                 filepath = path.join(self.directory, "{}_{}.blib".format(path.splitext(self.filename)[0], asset.name))
@@ -110,24 +123,36 @@ class ExportConfirmation(bpy.types.Operator):
         props = asset.export_props
         data = getattr(bpy.data, asset_info["data"])
         
+        if context.scene.blib.bundle:
+            return self.export_bundle(context)
+        
         success = 0
         failed = 0
+        incremental = context.scene.blib.incremental
+        cache = ExportCache(self.directory) if incremental else None
+        session = asset_info["exp_session"]()
+        source_hashes.reset_counters()
+        
+        #Keep the hashes of the source files along with the exported library, for the next incremental export
+        hashes_path = path.join(self.directory, ".blib_hashes.json")
+        if incremental:
+            source_hashes.load(hashes_path)
         
         print()
         
         for asset in assets:
             if asset.state == True:
                 filepath = path.join(self.directory, "{}_{}.blib".format(path.splitext(self.filename)[0], asset.name))
-                if context.scene.blib.action == "rename":
+                if context.scene.blib.action == "rename" and not incremental:
                     filepath = uniquify_name(filepath)
-                elif context.scene.blib.action == "ignore":
+                elif context.scene.blib.action == "ignore" and not incremental:
                     if path.isfile(filepath):
                         continue
                 
                 print()
                 print("Initiating export of '{}'".format(asset.name))
                 try:
-                    asset_info["exp_func"](data[asset.name], filepath, **{prop: getattr(props, prop) for prop in asset_info["exp_props"]})
+                    asset_info["exp_func"](data[asset.name], filepath, cache=cache, update=incremental, session=session, **{prop: getattr(props, prop) for prop in asset_info["exp_props"]})
                 except BlibException as e:
                     failed += 1
                     self.report({'WARNING'}, "'{}' failed to export.".format(asset.name))
@@ -140,6 +165,44 @@ class ExportConfirmation(bpy.types.Operator):
         self.report({'INFO'}, "{} of {} successful exports. Check system console for more info".format(success, success + failed))
         print()
         print("{} of {} successful exports.".format(success, success + failed))
+        
+        if cache is not None:
+            self.report({'INFO'}, "{skipped} files skipped, {updated} updated and {rebuilt} rebuilt.".format(**cache.counts))
+            for line in cache.report():
+                print(line)
+            cache.close()
+            source_hashes.save(hashes_path)
+        print("Source file hashes: {} reused, {} computed.".format(source_hashes.hits, source_hashes.misses))
+        print("Node groups: {} reused, {} serialized.".format(session.hits, session.misses))
+        return {'FINISHED'}
+    
+    def export_bundle(self, context):
+        asset_type = context.scene.blib.export_type
+        asset_info = context.scene.blib.asset_types[asset_type]
+        asset = getattr(context.scene.blib.assets, asset_type)
+        assets = asset.assets
+        props = asset.export_props
+        data = getattr(bpy.data, asset_info["data"])
+        
+        names = [asset.name for asset in assets if asset.state == True]
+        filepath = path.join(self.directory, "{}.blib".format(path.splitext(self.filename)[0]))
+        if context.scene.blib.action == "rename":
+            filepath = uniquify_name(filepath)
+        elif context.scene.blib.action == "ignore":
+            if path.isfile(filepath):
+                return {'FINISHED'}
+        
+        print()
+        print("Initiating export of {} assets to '{}'".format(len(names), bpy.path.basename(filepath)))
+        try:
+            asset_info["bundle_exp_func"]([data[name] for name in names], filepath, **{prop: getattr(props, prop) for prop in asset_info["exp_props"]})
+        except BlibException as e:
+            self.report({'WARNING'}, "Bundle failed to export.")
+            print("Bundle failed to export, with the following error:")
+            print(e)
+        else:
+            self.report({'INFO'}, "{} assets exported to bundle. Check system console for more info".format(len(names)))
+            print("{} assets exported to bundle successfully.".format(len(names)))
         return {'FINISHED'}
 
 class ExportBlib(bpy.types.Operator, ExportHelper):
@@ -161,6 +224,8 @@ class ExportBlib(bpy.types.Operator, ExportHelper):
         layout = self.layout
         
         layout.prop(context.scene.blib, "export_type")
+        layout.prop(context.scene.blib, "incremental")
+        layout.prop(context.scene.blib, "bundle")
         
         asset_info = context.scene.blib.asset_types[asset_type]
         
@@ -208,6 +273,7 @@ class ImportBlib(bpy.types.Operator, ImportHelper):
         layout = self.layout
         
         layout.prop(context.scene.blib, "import_type")
+        layout.prop(context.scene.blib, "import_names")
         
         asset_info = context.scene.blib.asset_types[asset_type]
         
@@ -220,6 +286,7 @@ class ImportBlib(bpy.types.Operator, ImportHelper):
         asset = getattr(context.scene.blib.assets, asset_type)
         props = asset.import_props
         sub = asset_type.split("_")[-1]
+        names = [name.strip() for name in context.scene.blib.import_names.split(",") if name.strip() != ""]
         
         success = 0
         failed = 0
@@ -237,24 +304,34 @@ class ImportBlib(bpy.types.Operator, ImportHelper):
                 continue
             filepath = path.join(self.directory, filename.name)
             
-            if not asset_info["check_file_func"](filepath, sub):
-                incompatible += 1
-                self.report({'WARNING'}, "{} is not of type '{}'.".format(filename.name, asset_info["name"]))
-                print("{} is not of type '{}'.".format(filename.name, asset_info["name"]))
-                continue
-            
-            print()
-            print("Initiating import of {}".format(filename.name))
-            try:
-                asset_info["imp_func"](filepath, **{prop: getattr(props, prop) for prop in asset_info["imp_props"]})
-            except BlibException as e:
-                failed += 1
-                self.report({'WARNING'}, "{} failed to import.".format(filename.name))
-                print("{} failed to import, with the following error:".format(filename.name))
-                print(e)
-            else:
-                success += 1
-                print("'{}' imported successfully.".format(filename.name))
+            #Open file only once, for both the check and the import
+            with BlibFile(filepath) as blib_file:
+                if not asset_info["check_file_func"](blib_file, sub):
+                    incompatible += 1
+                    self.report({'WARNING'}, "{} is not of type '{}'.".format(filename.name, asset_info["name"]))
+                    print("{} is not of type '{}'.".format(filename.name, asset_info["name"]))
+                    continue
+                
+                #Import every asset of the selected type from bundles
+                entries = [None]
+                bundle = asset_info["read_index_func"](blib_file)
+                if bundle is not None:
+                    entries = [entry["name"] for entry in bundle if entry["sub_type"] == sub]
+                
+                for name in entries:
+                    label = filename.name if name is None else "{} ({})".format(filename.name, name)
+                    print()
+                    print("Initiating import of {}".format(label))
+                    try:
+                        asset_info["imp_func"](blib_file, asset=name, sub_type=sub, names=names or None, **{prop: getattr(props, prop) for prop in asset_info["imp_props"]})
+                    except BlibException as e:
+                        failed += 1
+                        self.report({'WARNING'}, "{} failed to import.".format(label))
+                        print("{} failed to import, with the following error:".format(label))
+                        print(e)
+                    else:
+                        success += 1
+                        print("'{}' imported successfully.".format(label))
         
         if incompatible == 0:
             self.report({'INFO'}, "{} of {} successful imports. Check system console for more info".format(success, success + failed))
@@ -0,0 +1,69 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+# Part of the Asset_IO package.
+# Link export benchmark: Serialization time of node trees by number of links.
+# Copyright (C) 2016  Luca Rood
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+"""
+Measure how serializing the nodes and links of a node tree scales with the number of links.
+
+Builds synthetic node groups of up to 10,000 links, and must be run inside Blender:
+    blender --background --factory-startup --python benchmarks/links_export.py
+
+The time per link should stay roughly constant as the trees grow.
+"""
+
+import bpy
+
+import sys
+from os import path
+from time import perf_counter
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from blib.cycles.generate_xml import gen_tree
+
+def build_tree(links):
+    """Build a node group of math nodes, where every node is linked to both inputs of the next one."""
+    
+    tree = bpy.data.node_groups.new("bench_{}".format(links), 'ShaderNodeTree')
+    prev = tree.nodes.new("ShaderNodeMath")
+    while len(tree.links) < links:
+        node = tree.nodes.new("ShaderNodeMath")
+        tree.links.new(prev.outputs[0], node.inputs[0])
+        if len(tree.links) < links:
+            tree.links.new(prev.outputs[0], node.inputs[1])
+        prev = node
+    return tree
+
+def main():
+    print("{:>8} {:>8} {:>10} {:>12}".format("links", "nodes", "seconds", "us/link"))
+    per_link = []
+    for links in (1250, 2500, 5000, 10000):
+        tree = build_tree(links)
+        start = perf_counter()
+        gen_tree(tree, set(), {}, set(), False)
+        seconds = perf_counter() - start
+        per_link.append(seconds / links)
+        print("{:>8} {:>8} {:>10.3f} {:>12.1f}".format(links, len(tree.nodes), seconds, seconds / links * 1e6))
+        bpy.data.node_groups.remove(tree)
+    
+    print("Time per link at 10000 links is {:.2f}x the time at 1250 links (1.00x is linear scaling)".format(per_link[-1] / per_link[0]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+# Part of the Asset_IO package.
+# Parallel export benchmark: Throughput of blib.utils.ParallelWriter by number of threads.
+# Copyright (C) 2016  Luca Rood
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+"""
+Measure how the throughput of writing an image sequence to a .blib archive scales with the number of threads.
+
+Runs outside of Blender, as only 'blib.utils' is used:
+    python benchmarks/parallel_export.py --frames 200 --size 4
+
+Every run writes the same synthetic frames, and the archive checksums of all runs must match.
+"""
+
+import sys
+import argparse
+import random
+import zipfile as zf
+from os import path, cpu_count
+from tempfile import mkdtemp
+from shutil import rmtree
+from time import perf_counter
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from blib.utils import ParallelWriter, archive_sha1
+
+def gen_frames(directory, frames, size):
+    """Write 'frames' files of 'size' MiB of compressible data, with a few duplicates to exercise deduplication."""
+    
+    rand = random.Random(0)
+    paths = []
+    for i in range(frames):
+        f_path = path.join(directory, "frame_{:04}.exr".format(i))
+        if i % 10 == 9:
+            data = open(paths[-1], 'rb').read()
+        else:
+            data = bytes(rand.choice(b"abcdefgh") for _ in range(1 << 12)) * (size << 8)
+        f = open(f_path, 'wb')
+        f.write(data)
+        f.close()
+        paths.append(f_path)
+    return paths
+
+def run(paths, directory, threads):
+    a_path = path.join(directory, "bench_{}.blib".format(threads))
+    archive = zf.ZipFile(a_path, 'w', zf.ZIP_DEFLATED)
+    start = perf_counter()
+    with ParallelWriter(archive, {}, threads) as writer:
+        for f_path in paths:
+            writer.write(f_path, "images/seq/" + path.basename(f_path))
+    seconds = perf_counter() - start
+    checksum = archive_sha1(archive).hexdigest()
+    archive.close()
+    return seconds, checksum
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--frames", type=int, default=200, help="Number of frames in the sequence")
+    parser.add_argument("--size", type=int, default=4, help="Size of each frame in MiB")
+    parser.add_argument("--threads", type=int, nargs="*", help="Thread counts to run (default: powers of two up to the CPU count)")
+    args = parser.parse_args()
+    
+    threads = args.threads
+    if not threads:
+        threads = [1]
+        while threads[-1] * 2 <= (cpu_count() or 1):
+            threads.append(threads[-1] * 2)
+    
+    directory = mkdtemp()
+    try:
+        paths = gen_frames(directory, args.frames, args.size)
+        total = args.frames * args.size
+        base = None
+        checksums = set()
+        print("{:>8} {:>10} {:>10} {:>8}".format("threads", "seconds", "MiB/s", "speedup"))
+        for count in threads:
+            seconds, checksum = run(paths, directory, count)
+            checksums.add(checksum)
+            base = seconds if base is None else base
+            print("{:>8} {:>10.2f} {:>10.1f} {:>7.2f}x".format(count, seconds, total / seconds, base / seconds))
+        
+        if len(checksums) != 1:
+            print("Archive checksums differ between thread counts")
+            return 1
+        print("Archive checksum identical for all thread counts: {}".format(checksums.pop()))
+        return 0
+    finally:
+        rmtree(directory)
+
+if __name__ == "__main__":
+    sys.exit(main())
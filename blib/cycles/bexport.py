@@ -23,12 +23,17 @@ import bpy
 
 import re
 import zipfile as zf
-from os import path, listdir
+import xml.etree.cElementTree as ET
+from os import path, listdir, remove, replace, close, chmod, stat
+from tempfile import mkstemp
+from time import perf_counter
+from zlib import crc32
+from hashlib import sha1
 
 from .version import version, compatible
-from .generate_xml import generate_xml
+from .generate_xml import generate_xml, ExportSession
 from .utils import check_asset
-from ..utils import archive_sha1, write
+from ..utils import archive_sha1, gen_crc, gen_hash, member_hash, get_path, store, open_member, write_link, store_references, copy_raw, ParallelWriter, CodecPolicy
 
 def file_int(f):
     return int(re.sub(r".*?([0-9]+)$", r"\1", f))
@@ -68,7 +73,8 @@ def find_range(files, val, lower):
                 return mid - 1
 
 def bexport(asset, filepath, imgi_export=True, imge_export=True, seq_export=True, mov_export=True,
-        txti_export=True, txte_export=True, script_export=True, optimize_file=False, compress=True):
+        txti_export=True, txte_export=True, script_export=True, optimize_file=False, compress=True, threads=0,
+        compress_level=6, text_codec="DEFLATED", cache=None, update=False, session=None):
     """
     Export a Cycles material or node group to a .blib file.
     
@@ -84,7 +90,22 @@ def bexport(asset, filepath, imgi_export=True, imge_export=True, seq_export=True
         txte_export (bool): Export texts that are externally saved.
         script_export (bool): Export scripts that are referenced by path in "script" node.
         optimize_file (bool): Optimize file, by not including variables qual to None or "".
-        compress (bool): Use compression on the zip container.
+        compress (bool): Use compression on the zip container. Files that are already compressed
+            (such as most image and movie formats) are stored as they are.
+        threads (int): Number of threads used to compress the files, 0 to use one thread per CPU core.
+            The resulting file is the same regardless of the number of threads.
+        compress_level (int): Compression level (0-9), used when 'compress' is True.
+        text_codec (str): Compression used for the structure XML and texts when 'compress' is True,
+            one of "DEFLATED", "BZIP2" or "LZMA".
+        cache (blib.utils.ExportCache or None): Cache of the files previously exported to the same directory.
+            If given, the file is left as it is if nothing changed since it was exported,
+            and only the structure XML is replaced if none of the resources changed.
+        update (bool): If 'filepath' already exists, update it in place: the structure XML is replaced,
+            and the resources that did not change are copied from the existing file without being compressed again.
+            If 'cache' is given, this is only done if the file was exported with the same compression options,
+            otherwise the file is rebuilt, so that the new options apply to all resources.
+        session (blib.cycles.generate_xml.ExportSession or None): Cache shared by the exports of a batch,
+            from which the node groups already serialized in the batch are reused.
     
     Raises:
         blib.exeptions.InvalidObject: If the 'asset' argument is not a Cycles material or node tree.
@@ -93,21 +114,185 @@ def bexport(asset, filepath, imgi_export=True, imge_export=True, seq_export=True
     check_asset(asset, True)
     
     filepath = bpy.path.abspath(filepath) #Ensure path is absolute
-    xml, imgs, txts = generate_xml(asset, imgi_export, imge_export, seq_export, mov_export, txti_export,
-                                   txte_export, script_export, optimize_file, True, False, False) #Generate XML
     compression = zf.ZIP_DEFLATED if compress else zf.ZIP_STORED
+    policy = CodecPolicy(compress_level, text_codec) if compress else None
+    
+    #Compare with the previous export, which requires the XML to be generated before writing anything
+    if cache is not None or update:
+        xml, imgs, txts = generate_xml(asset, imgi_export, imge_export, seq_export, mov_export, txti_export,
+                                       txte_export, script_export, optimize_file, True, False, False, session=session)
+        resources = list(gen_resources(imgs, txts))
+        options = "{} {} {}".format(compress, compress_level, text_codec)
+        xml_hash = sha1(xml).hexdigest()
+        crcs = {destination: gen_crc(source) if isinstance(source, str) else crc32(source) for source, destination in resources}
+        action = cache.check(filepath, options, xml_hash, crcs) if cache is not None else "rebuilt"
+        
+        if action == "skipped":
+            cache.add(filepath, action, options, xml_hash, crcs)
+            return
+        
+        #Replace the structure XML, copying the unchanged resources from the previous export,
+        #which would keep the compression they were written with
+        if action == "updated" or (update and path.isfile(filepath) and (cache is None or cache.options(filepath) == options)):
+            if update_archive(asset, filepath, xml, resources, crcs, compression, policy, threads):
+                if cache is not None:
+                    cache.add(filepath, action, options, xml_hash, crcs)
+                return
+    
     archive = zf.ZipFile(filepath, 'w', compression) #Create archive
-    archive.writestr('structure.xml', xml) #Write XML to archive
-    crcs = {}
     
-    #Write text files to archive
+    if cache is not None or update:
+        store(archive, xml, 'structure.xml', policy)
+    else:
+        #Generate XML, writing it to the archive while it is generated
+        start = perf_counter()
+        xml_file = open_member(archive, 'structure.xml', policy)
+        try:
+            xml, imgs, txts = generate_xml(asset, imgi_export, imge_export, seq_export, mov_export, txti_export,
+                                           txte_export, script_export, optimize_file, True, False, False, xml_file, session)
+        except:
+            xml_file.close()
+            archive.close()
+            remove(filepath)
+            raise
+        xml_file.close()
+        if policy is not None:
+            policy.record(archive.getinfo('structure.xml'), perf_counter() - start)
+        resources = gen_resources(imgs, txts)
+    
+    #Write texts and images to archive
+    try:
+        with ParallelWriter(archive, {}, threads, policy) as writer:
+            for source, destination in resources:
+                writer.write(source, destination)
+    except:
+        archive.close()
+        remove(filepath)
+        raise
+    
+    if policy is not None:
+        for line in policy.report():
+            print(line)
+    
+    close_archive(archive, asset_sub_type(asset))
+    
+    if cache is not None:
+        cache.add(filepath, "rebuilt", options, xml_hash, crcs)
+
+def update_archive(asset, filepath, xml, resources, crcs, compression, policy=None, threads=0):
+    """
+    Write an asset over a previous export of it, copying the compressed data of the resources that did not change.
+    
+    Resources with the same crc32 hash and size as the existing member are compared with it by sha256 hash,
+    so that only identical data is copied.
+    
+    The new file is written to a uniquely named file next to the existing one, and only replaces it once complete.
+    
+    Args:
+        asset (bpy.types.Material or bpy.types.ShaderNodeTree): The exported asset.
+        filepath (str): Path to the existing file.
+        xml (bytes): The structure XML.
+        resources (list[tuple]): The resources to be written, as generated by 'gen_resources'.
+        crcs (dict): Dictionary mapping the paths of the resources within the archive to their crc32 hash.
+        compression (int): zipfile compression constant of the archive.
+        policy (blib.utils.CodecPolicy or None): Policy choosing the compression of the changed resources.
+        threads (int): Number of threads used to compress the changed resources.
+    
+    Returns:
+        bool: True if the file was updated, False if the existing file is not a valid archive.
+    """
+    
+    try:
+        source = zf.ZipFile(filepath, 'r')
+    except (zf.BadZipFile, OSError):
+        return False
+    
+    #Concurrent updates of the same file each write their own file, and never overwrite a leftover of an interrupted one
+    #The updated file keeps the permissions of the existing one
+    try:
+        fd, tmp_path = mkstemp(".tmp", path.basename(filepath) + ".", path.dirname(filepath))
+        close(fd)
+        try:
+            chmod(tmp_path, stat(filepath).st_mode & 0o777)
+            archive = zf.ZipFile(tmp_path, 'w', compression)
+        except:
+            remove(tmp_path)
+            raise
+    except:
+        source.close()
+        raise
+    
+    try:
+        store(archive, xml, 'structure.xml', policy)
+        
+        index = {}
+        with ParallelWriter(archive, index, threads, policy) as writer:
+            for data, destination in resources:
+                try:
+                    zpath = get_path(source, destination)
+                    zinfo = source.getinfo(zpath)
+                except KeyError:
+                    zinfo = None
+                
+                #The sha256 hash of the resource is the one used for deduplication, so it is only computed once
+                unchanged = False
+                size = path.getsize(data) if isinstance(data, str) else len(data)
+                if zinfo is not None and zinfo.CRC == crcs[destination] and zinfo.file_size == size:
+                    key = gen_hash(data)
+                    try:
+                        unchanged = member_hash(source, zpath) == key
+                    except zf.BadZipFile:
+                        pass
+                
+                if not unchanged:
+                    writer.write(data, destination)
+                else:
+                    #Keep the members in order, by writing pending members first
+                    writer.flush()
+                    
+                    #Copied members are added to the deduplication index, so that identical changed resources are linked to them
+                    if key in index:
+                        write_link(archive, destination, index[key])
+                    else:
+                        copy_raw(source, zpath, archive, destination)
+                        index[key] = destination
+        
+        if policy is not None:
+            for line in policy.report():
+                print(line)
+        
+        close_archive(archive, asset_sub_type(asset))
+        replace(tmp_path, filepath)
+    except:
+        archive.close()
+        remove(tmp_path)
+        raise
+    finally:
+        source.close()
+    return True
+
+def gen_resources(imgs, txts):
+    """
+    Generate the data of the texts and images to be written to the archive of an asset.
+    
+    Args:
+        imgs (list[dict]): Images used by the asset, as returned by 'generate_xml'.
+        txts (list[dict]): Texts used by the asset, as returned by 'generate_xml'.
+    
+    Yields:
+        (source, destination)
+        source (str or bytes): The path to the file to be written or the data itself.
+        destination (str): The path within the archive to which the data should be written.
+    """
+    
+    #Text files
     for txt in txts:
         if "text" in txt:
-            write(archive, txt["text"].as_string().encode("utf-8"), txt["destination"], crcs)
+            yield txt["text"].as_string().encode("utf-8"), txt["destination"]
         else:
-            write(archive, txt["source"], txt["destination"], crcs)
+            yield txt["source"], txt["destination"]
     
-    #Write images to archive
+    #Images
     for img in imgs:
         if img["image"].source == 'SEQUENCE':
             ### Image sequence code
@@ -120,28 +305,110 @@ def bexport(asset, filepath, imgi_export=True, imge_export=True, seq_export=True
             files_int = [file_int(fil) for fil in files]
             start = find_range(files_int, img["range"][0], True)
             end = find_range(files_int, img["range"][1], False)
+            names = set()
             for i in range(start, end + 1):
                 source = path.join(p, files[i] + e)
                 destination = img["destination"] + "/" + files[i] + e
-                write(archive, source, destination, crcs)
+                names.add(destination)
+                yield source, destination
             
-            if not img["destination"] + "/" + bpy.path.basename(img["image"].filepath) in archive.namelist():
+            if not img["destination"] + "/" + bpy.path.basename(img["image"].filepath) in names:
                 source = bpy.path.abspath(img["image"].filepath)
                 destination = img["destination"] + "/" + bpy.path.basename(img["image"].filepath)
-                write(archive, source, destination, crcs)
+                yield source, destination
         else:
             if img["image"].packed_file is None:
                 source = bpy.path.abspath(img["image"].filepath)
                 destination = img["destination"]
-                write(archive, source, destination, crcs)
+                yield source, destination
             else:
                 source = img["image"].packed_file.data
                 destination = img["destination"]
-                write(archive, source, destination, crcs)
+                yield source, destination
+
+def bexport_bundle(assets, filepath, imgi_export=True, imge_export=True, seq_export=True, mov_export=True,
+        txti_export=True, txte_export=True, script_export=True, optimize_file=False, compress=True, threads=0,
+        compress_level=6, text_codec="DEFLATED", session=None):
+    """
+    Export several Cycles materials and node groups to a single .blib bundle.
+    
+    Each asset is stored as in a single asset file, under "assets/<number>/", and identical resources
+    are only stored once for the whole bundle. An "index.xml" member lists the assets,
+    so that a single one can be imported without reading the others.
+    
+    Args:
+        assets (list[bpy.types.Material or bpy.types.ShaderNodeTree]): The assets to be exported.
+        filepath (str): Path to save the file.
+        session (blib.cycles.generate_xml.ExportSession or None): Cache shared by the exports of a batch,
+            if None, a new one is used for the assets of the bundle.
+        Other arguments: The same as for 'bexport'.
+    
+    Raises:
+        blib.exeptions.InvalidObject: If any of the assets is not a Cycles material or node tree.
+    """
+    
+    for asset in assets:
+        check_asset(asset, True)
+    
+    if session is None:
+        session = ExportSession()
+    
+    filepath = bpy.path.abspath(filepath) #Ensure path is absolute
+    compression = zf.ZIP_DEFLATED if compress else zf.ZIP_STORED
+    policy = CodecPolicy(compress_level, text_codec) if compress else None
+    archive = zf.ZipFile(filepath, 'w', compression) #Create archive
+    
+    xindex = ET.Element("blib")
+    xindex.set("type", "cycles")
+    xindex.set("version", str(version))
+    xindex.set("compatible", str(version))
+    
+    try:
+        with ParallelWriter(archive, {}, threads, policy) as writer:
+            for i, asset in enumerate(assets):
+                prefix = "assets/{}/".format(i)
+                xml, imgs, txts = generate_xml(asset, imgi_export, imge_export, seq_export, mov_export, txti_export,
+                                               txte_export, script_export, optimize_file, True, False, False,
+                                               session=session, prefix=prefix)
+                writer.write(xml, prefix + "structure.xml")
+                
+                #Write texts and images to archive, sharing identical ones with the previous assets
+                for source, destination in gen_resources(imgs, txts):
+                    writer.write(source, destination)
+                
+                xasset = ET.SubElement(xindex, "asset")
+                xasset.set("name", asset.name)
+                xasset.set("sub_type", asset_sub_type(asset))
+                xasset.set("path", prefix + "structure.xml")
+        
+        store(archive, b"<?xml version='1.0' encoding='utf-8'?>" + ET.tostring(xindex, encoding="utf-8"), "index.xml", policy)
+    except:
+        archive.close()
+        remove(filepath)
+        raise
+    
+    if policy is not None:
+        for line in policy.report():
+            print(line)
+    
+    #Bundles can't be read by releases older than this one
+    close_archive(archive, "bundle", version)
+
+def asset_sub_type(asset):
+    """Get the Blib sub-type of an asset ("mat" for materials and "grp" for node groups)."""
+    
+    return "mat" if isinstance(asset, bpy.types.Material) else "grp"
+
+def close_archive(archive, sub_type, compat=compatible):
+    """Save the reference table, write the checksum and meta-data of the exported assets to the archive comment, and close the archive."""
+    
+    #Files with a reference table can't be read by releases older than this one
+    if store_references(archive):
+        compat = version
     
     checksum = archive_sha1(archive)
     
-    comment = checksum.hexdigest() + " cycles " + str(version) + " " + str(compatible)
+    comment = checksum.hexdigest() + " cycles " + str(version) + " " + str(compat) + " " + sub_type
     
     archive.comment = comment.encode("utf-8")
     
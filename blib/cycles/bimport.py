@@ -21,21 +21,27 @@
 
 import bpy
 
-import re
+import zlib
+import sys
+import json
 import zipfile as zf
 import xml.etree.cElementTree as ET
 from ast import literal_eval
-from os import path, listdir, makedirs, remove
+from math import isinf, isnan
+from array import array
+from base64 import b64decode
+from os import path, makedirs
 from shutil import rmtree
 
 from .version import version
-from ..utils import files_equal, archive_sha1, fail, extract, get_path
-from ..utils import Version, ResourceDir
+from ..utils import fail, extract, get_path, references, member_names
+from ..utils import Version, ResourceDir, ResourceStore, BlibFile, Verifier, Extractor
+from .utils import read_index
 from ..exceptions import InvalidBlibFile, BlibVersionError, BlibTypeError
 
-def extract_image(archive, source, destination, path_dict, failed):
+def extract_image(extractor, source, destination, path_dict, failed):
     try:
-        ipath = extract(archive, source, destination)
+        ipath = extractor.submit(source, destination)
     except KeyError:
         fail(failed, "images", "import image '{}', file is missing".format(source))
         return None
@@ -43,7 +49,75 @@ def extract_image(archive, source, destination, path_dict, failed):
         path_dict[source] = ipath
         return ipath
 
-def import_texts(orig, dest, xtxt, txts, failed, archive, txt_dir, txt_paths=None):
+def discard_extracted(img_dir, tmp_path, store=None):
+    """Remove the files extracted by an import that could not be completed, and discard their index entries."""
+    
+    if store is not None:
+        store.close()
+    if img_dir:
+        rmtree(str(img_dir))
+    if tmp_path:
+        rmtree(str(tmp_path))
+
+def text_members(names):
+    """Get the files among 'names' that store texts and scripts, which are kept in memory while verifying them."""
+    
+    return {name for name in names if name.rsplit("/", 2)[-2:-1] == ["texts"]}
+
+def read_text(archive, item, kept):
+    """
+    Read a text or script from the archive, using the data kept while verifying it if available.
+    
+    Raises:
+        KeyError: If the item is not in the archive.
+    """
+    
+    tpath = get_path(archive, item)
+    if kept and tpath in kept:
+        return kept[tpath]
+    return archive.read(tpath)
+
+def write_text(archive, item, directory, kept, extractor=None):
+    """
+    Extract a text or script, writing the data kept while verifying it if available, instead of reading it again.
+    Otherwise it is extracted with 'extractor', in which case the file is only complete once it has been waited for,
+    or right away if 'extractor' is None.
+    
+    Returns:
+        str: Path to the extracted file.
+    
+    Raises:
+        KeyError: If the item is not in the archive.
+    """
+    
+    tpath = get_path(archive, item)
+    if not kept or tpath not in kept:
+        return extractor.submit(item, directory) if extractor is not None else extract(archive, item, directory)
+    
+    d_path = path.join(directory, path.basename(item))
+    tfile = open(d_path, 'wb')
+    tfile.write(kept[tpath])
+    tfile.close()
+    return d_path
+
+def image_members(archive, ximgs):
+    """Get the files in the archive that are read when importing the images listed in 'ximgs'."""
+    
+    names = set()
+    for ximg in ximgs:
+        if ximg.attrib["source"] == 'SEQUENCE':
+            seq_dir = path.dirname(ximg.attrib["path"])
+            items = [img for img in member_names(archive) if img.startswith(seq_dir)]
+        else:
+            items = [ximg.attrib["path"]]
+        for item in items:
+            try:
+                names.add(get_path(archive, item))
+            except KeyError:
+                pass
+    return names
+
+def import_texts(orig, dest, xtxt, txts, failed, archive, txt_dir, txt_paths=None, extracted=None, kept=None):
     if orig == "xml": #From XML
         if dest == "ext": #To external
             tpath = path.join(str(txt_dir), xtxt.attrib["name"])
@@ -72,10 +146,9 @@ def import_texts(orig, dest, xtxt, txts, failed, archive, txt_dir, txt_paths=Non
                     txt_paths[xtxt.attrib["path"]] = txt
     
     elif orig == "zip": #From Zip
-        if dest == "ext":  #To external
-            try:
-                tpath = extract(archive, xtxt.attrib["path"], str(txt_dir))
-            except KeyError:
+        if dest == "ext":  #To external, already extracted to the paths in 'extracted'
+            tpath = extracted.get(xtxt.attrib["path"])
+            if tpath is None:
                 fail(failed, "texts", "import text '{}', file is missing".format(xtxt.attrib["name"]))
             else:
                 try:
@@ -88,15 +161,14 @@ def import_texts(orig, dest, xtxt, txts, failed, archive, txt_dir, txt_paths=Non
                         txt_paths[xtxt.attrib["path"]] = tpath
         
         elif dest == "int": #To internal
-            tpath = get_path(archive, xtxt.attrib["path"])
             try:
-                tfile = archive.open(tpath, 'r')
+                data = read_text(archive, xtxt.attrib["path"], kept)
             except KeyError:
                 fail(failed, "texts", "import text '{}', file is missing".format(xtxt.attrib["name"]))
             else:
                 txt = bpy.data.texts.new(xtxt.attrib["name"])
                 try:
-                    txt.from_string(tfile.read().decode("utf-8"))
+                    txt.from_string(data.decode("utf-8"))
                 except:
                     bpy.data.texts.remove(txt)
                     fail(failed, "texts", "import text '{}', unknown reason".format(xtxt.attrib["name"]))
@@ -104,22 +176,179 @@ def import_texts(orig, dest, xtxt, txts, failed, archive, txt_dir, txt_paths=Non
                     txts[xtxt.attrib["name"]] = txt
                     if txt_paths is not None:
                         txt_paths[xtxt.attrib["path"]] = txt
-                tfile.close()
 
-def set_attributes(asset, xelement, failed):
-    for attr in xelement.attrib:
-        if not attr.startswith("blib_") and \
-           not (attr == "name" and isinstance(asset, bpy.types.Material)) and \
-           not (attr == "mode" and isinstance(asset, bpy.types.ShaderNodeScript)):
+def decode_literal(string):
+    try:
+        return literal_eval(string)
+    except (ValueError, SyntaxError):
+        return string
+
+def decode_string(string):
+    return string
+
+def decode_bool(string):
+    return {"True": True, "False": False}[string]
+
+def decode_int(string):
+    return int(string)
+
+def decode_float(string):
+    val = float(string)
+    if isinf(val) or isnan(val):
+        raise ValueError("not a finite number")
+    return val
+
+def decode_array(decode_item):
+    def decode(string):
+        if not (string.startswith("[") and string.endswith("]")):
+            raise ValueError("not an array")
+        return [decode_item(item) for item in string[1:-1].split(", ")]
+    return decode
+
+#Decoders for RNA property types, anything else is decoded as a Python literal
+decoders = {
+    'BOOLEAN': decode_bool,
+    'INT': decode_int,
+    'FLOAT': decode_float,
+    'STRING': decode_string,
+    'ENUM': decode_string
+}
+
+#Attribute application plans, cached for the session by type (see 'get_applier')
+appliers = {}
+
+def get_applier(asset, attr):
+    """
+    Get how an attribute is applied to objects of the type of 'asset', working it out on first use.
+    
+    Args:
+        asset (bpy.types.bpy_struct): The object to which the attribute is applied.
+        attr (str): Name of the attribute.
+    
+    Returns:
+        function, False or None
+        The function decoding the attribute string to its value,
+        False if the attribute is read-only, or None if the attribute is not to be applied.
+    """
+    
+    plan = appliers.setdefault(type(asset), {})
+    if attr not in plan:
+        if attr.startswith("blib_") or \
+           (attr == "name" and isinstance(asset, bpy.types.Material)) or \
+           (attr == "mode" and isinstance(asset, bpy.types.ShaderNodeScript)):
+            plan[attr] = None
+        else:
+            prop = asset.bl_rna.properties.get(attr) if hasattr(asset, "bl_rna") else None
+            if prop is None:
+                plan[attr] = decode_literal
+            elif prop.is_readonly:
+                plan[attr] = False
+            elif prop.type == 'ENUM' and prop.is_enum_flag:
+                plan[attr] = decode_literal
+            elif getattr(prop, "array_length", 0) > 0:
+                plan[attr] = decode_array(decoders[prop.type]) if prop.type in decoders else decode_literal
+            else:
+                plan[attr] = decoders.get(prop.type, decode_literal)
+    return plan[attr]
+
+def decode_none(string):
+    return None
+
+def decode_flag(string):
+    return string == "1"
+
+def decode_list(decode_item):
+    def decode(string):
+        return [decode_item(item) for item in string.split()]
+    return decode
+
+def decode_enum_set(string):
+    return set(string.split())
+
+#Decoders for the type codes of typed attributes (see 'generate_xml.encode_value')
+typed_decoders = {
+    'b': decode_flag,
+    'i': int,
+    'f': float,
+    's': decode_string,
+    'n': decode_none,
+    'B': decode_list(decode_flag),
+    'I': decode_list(int),
+    'F': decode_list(float),
+    'E': decode_enum_set,
+    'j': json.loads
+}
+
+def read_structs(xroot, structs=None):
+    """
+    Read the attribute structures defined in a structure XML.
+    
+    Args:
+        xroot (xml.etree.ElementTree.Element): The element in which to look for structure definitions.
+        structs (dict or None): Dictionary to which the structures are added, a new one is created if None.
+    
+    Returns:
+        dict: Dictionary mapping the structure numbers to lists of (attribute name, type code) tuples.
+    """
+    
+    if structs is None:
+        structs = {}
+    for xelement in xroot.iter():
+        if "blib_types" in xelement.attrib:
+            structs[xelement.attrib["blib_struct"]] = [tuple(item.rsplit(":", 1)) for item in xelement.attrib["blib_types"].split(" ")]
+    return structs
+
+def set_attributes(asset, xelement, failed, structs=None):
+    #Files since version 0.2.0 store the types of the attributes, older files are decoded by guessing
+    if structs is not None and "blib_struct" in xelement.attrib:
+        items = [(attr, typed_decoders[code]) for attr, code in structs[xelement.attrib["blib_struct"]]]
+        guess = False
+    else:
+        items = [(attr, None) for attr in xelement.attrib]
+        guess = True
+    
+    for attr, decode in items:
+        applier = get_applier(asset, attr)
+        if applier is None:
+            continue
+        
+        if applier is False:
+            fail(failed, "attributes", "set attribute '{}' on object '{}'".format(attr, asset.name))
+            continue
+        
+        string = xelement.attrib[attr]
+        if guess:
             try:
-                val = literal_eval(xelement.attrib[attr])
-            except (ValueError, SyntaxError):
-                val = xelement.attrib[attr]
-            
+                val = applier(string)
+            except (ValueError, KeyError):
+                val = decode_literal(string)
+        else:
             try:
-                setattr(asset, attr, val)
-            except:
+                val = decode(string)
+            except ValueError:
                 fail(failed, "attributes", "set attribute '{}' on object '{}'".format(attr, asset.name))
+                continue
+        
+        try:
+            setattr(asset, attr, val)
+        except:
+            fail(failed, "attributes", "set attribute '{}' on object '{}'".format(attr, asset.name))
+
+#Curve point handle types by their single character codes (see 'generate_xml.handle_codes')
+handle_types = {
+    "a": 'AUTO',
+    "c": 'AUTO_CLAMPED',
+    "v": 'VECTOR'
+}
+
+def unpack_floats(string):
+    """Decode a list of numbers encoded as base64 of little-endian float32 (see 'generate_xml.pack_floats')."""
+    
+    data = array("f")
+    data.frombytes(b64decode(string))
+    if sys.byteorder == "big":
+        data.byteswap()
+    return data
 
 def make_sockets(tree, inp, out, xinpn, xoutn):
     types = ['VALUE', 'INT', 'BOOLEAN', 'VECTOR', 'STRING', 'RGBA', 'SHADER']
@@ -171,6 +400,8 @@ def build_tree(xnodes, xlinks, tree, resources, txt_embed, txt_dir, blib, script
     txt_paths = resources["text_paths"]
     scripts = resources["scripts"]
     grps = resources["groups"]
+    structs = resources["structs"]
+    kept = resources["kept"]
     xinp = None
     xout = None
     inp = None
@@ -199,22 +430,20 @@ def build_tree(xnodes, xlinks, tree, resources, txt_embed, txt_dir, blib, script
                             node.script = txt_paths[blib_path]
                             scripts[blib_path] = txt_paths[blib_path]
                         else:
-                            spath = get_path(archive, xnode.attrib["blib_filepath"])
                             try:
-                                sfile = archive.open(spath, 'r')
+                                data = read_text(archive, blib_path, kept)
                             except KeyError:
                                 fail(failed, "scripts", "import script '{}', file is missing".format(blib_path))
                             else:
                                 script = bpy.data.texts.new(bpy.path.basename(blib_path))
                                 try:
-                                    script.from_string(sfile.read().decode("utf-8"))
+                                    script.from_string(data.decode("utf-8"))
                                 except:
                                     bpy.data.texts.remove(script)
                                     fail(failed, "scripts", "import script '{}', unknown reason".format(blib_path))
                                 else:
                                     scripts[blib_path] = script
                                     node.script = script
-                                sfile.close()
                     else:
                         node.mode = 'EXTERNAL'
                         if blib_path in scripts:
@@ -224,7 +453,7 @@ def build_tree(xnodes, xlinks, tree, resources, txt_embed, txt_dir, blib, script
                             scripts[blib_path] = txt_paths[blib_path]
                         else:
                             try:
-                                spath = extract(archive, blib_path, str(txt_dir))
+                                spath = write_text(archive, blib_path, str(txt_dir), kept)
                             except KeyError:
                                 fail(failed, "scripts", "import script '{}', file is missing".format(blib_path))
                             else:
@@ -247,30 +476,56 @@ def build_tree(xnodes, xlinks, tree, resources, txt_embed, txt_dir, blib, script
                 if img in imgs:
                     node.image = imgs[img]
                 ximageuser = xnode.find("image_user")
-                set_attributes(node.image_user, ximageuser, failed)
+                set_attributes(node.image_user, ximageuser, failed, structs)
         elif hasattr(node, "mapping") and hasattr(node.mapping, "curves"):
             xcurvedata = xnode.find("curve_data")
-            curvedata = literal_eval(xcurvedata.text)
-            for c_i, curve in enumerate(curvedata):
-                for p_i, point in enumerate(curve):
-                    if p_i == 0 or p_i == len(curve) - 1:
-                        node.mapping.curves[c_i].points[p_i].location = point[0]
-                        node.mapping.curves[c_i].points[p_i].handle_type = point[1]
-                    else:
-                        node.mapping.curves[c_i].points.new(point[0][0], point[0][1])
-                        node.mapping.curves[c_i].points[p_i].handle_type = point[1]
+            if "encoding" in xcurvedata.attrib: #Packed since version 0.2.0
+                locations = unpack_floats(xcurvedata.text)
+                handles = xcurvedata.attrib["handles"]
+                start = 0
+                for curve, count in zip(node.mapping.curves, xcurvedata.attrib["counts"].split()):
+                    count = int(count)
+                    while len(curve.points) < count:
+                        curve.points.new(0.0, 0.0)
+                    while len(curve.points) > count:
+                        curve.points.remove(curve.points[-1])
+                    curve.points.foreach_set("location", locations[start * 2:(start + count) * 2])
+                    for point, code in zip(curve.points, handles[start:start + count]):
+                        point.handle_type = handle_types[code]
+                    start += count
+            else:
+                curvedata = literal_eval(xcurvedata.text)
+                for c_i, curve in enumerate(curvedata):
+                    for p_i, point in enumerate(curve):
+                        if p_i == 0 or p_i == len(curve) - 1:
+                            node.mapping.curves[c_i].points[p_i].location = point[0]
+                            node.mapping.curves[c_i].points[p_i].handle_type = point[1]
+                        else:
+                            node.mapping.curves[c_i].points.new(point[0][0], point[0][1])
+                            node.mapping.curves[c_i].points[p_i].handle_type = point[1]
             node.mapping.update()
         elif hasattr(node, "color_ramp"):
             xrampdata = xnode.find("ramp_data")
-            rampdata = literal_eval(xrampdata.text)
-            set_attributes(node.color_ramp, xrampdata, failed)
-            for e_i, element in enumerate(rampdata):
-                if e_i == 0 or e_i == len(rampdata) - 1:
-                    node.color_ramp.elements[e_i].position = element[0]
-                    node.color_ramp.elements[e_i].color = element[1]
-                else:
-                    node.color_ramp.elements.new(element[0])
-                    node.color_ramp.elements[e_i].color = element[1]
+            set_attributes(node.color_ramp, xrampdata, failed, structs)
+            elements = node.color_ramp.elements
+            if "encoding" in xrampdata.attrib: #Packed since version 0.2.0
+                data = unpack_floats(xrampdata.text)
+                count = len(data) // 5
+                while len(elements) < count:
+                    elements.new(0.0)
+                while len(elements) > count:
+                    elements.remove(elements[-1])
+                elements.foreach_set("position", data[:count])
+                elements.foreach_set("color", data[count:])
+            else:
+                rampdata = literal_eval(xrampdata.text)
+                for e_i, element in enumerate(rampdata):
+                    if e_i == 0 or e_i == len(rampdata) - 1:
+                        elements[e_i].position = element[0]
+                        elements[e_i].color = element[1]
+                    else:
+                        elements.new(element[0])
+                        elements[e_i].color = element[1]
         nodes[xnode.attrib["name"]] = node
     
     set_grp_io(xinp, xout, inp, out, tree)
@@ -305,26 +560,135 @@ def build_tree(xnodes, xlinks, tree, resources, txt_embed, txt_dir, blib, script
         if "blib_parent" in xnode.attrib:
             node.parent = nodes[xnode.attrib["blib_parent"]]
         
-        set_attributes(node, xnode, failed)
+        set_attributes(node, xnode, failed, structs)
         
         xinps = xnode.find("inputs")
         xouts = xnode.find("outputs")
         
         if xinps is not None:
             for i_i, xinp in enumerate(xinps):
-                set_attributes(node.inputs[i_i], xinp, failed)
+                set_attributes(node.inputs[i_i], xinp, failed, structs)
         
         if xouts is not None:
             for o_i, xout in enumerate(xouts):
-                set_attributes(node.outputs[o_i], xout, failed)
+                set_attributes(node.outputs[o_i], xout, failed, structs)
+
+def parse_structure(xml_file):
+    """
+    Parse a structure XML incrementally.
+    
+    Args:
+        xml_file (file object): The structure XML file.
+    
+    Yields:
+        (str, xml.etree.ElementTree.Element): The "start" and "end" events of the elements in the file, as they are parsed.
+    
+    Raises:
+        blib.exeptions.InvalidBlibFile: If the file is broken.
+    """
+    
+    try:
+        for event, xelement in ET.iterparse(xml_file, events=("start", "end")):
+            yield event, xelement
+    except (ET.ParseError, zf.BadZipFile, zlib.error):
+        xml_file.close()
+        raise InvalidBlibFile("File is broken")
+
+def select_assets(xml_file, names):
+    """
+    Work out which parts of a structure XML are needed to build only some of the assets it contains.
+    
+    The parsed elements are kept, so that the assets can then be built without parsing the file again.
+    
+    Args:
+        xml_file (file object): The structure XML file, which is closed once read.
+        names (list[str]): Names of the node groups and/or material to be built.
+    
+    Returns:
+        dict: The needed parts, in format:
+            dict{
+                "groups" (set[str]): Names of the node groups to be built, including those used by the selected assets,
+                "main" (bool): True if the material is to be built,
+                "images" (dict): Image elements of the needed images, by name,
+                "texts" (set[str]): Names of the needed texts,
+                "paths" (set[str]): Paths within the archive of the needed texts and scripts,
+                "missing" (set[str]): Requested names that are not in the file,
+                "events" (list[tuple]): The events of the parsed file, as yielded by 'parse_structure',
+                }
+    
+    Raises:
+        blib.exeptions.InvalidBlibFile: If the file is broken.
+    """
+    
+    uses = {}
+    ximgs = {}
+    text_names = {}
+    events = []
+    xstack = []
+    for event, xelement in parse_structure(xml_file):
+        events.append((event, xelement))
+        if event == "start":
+            xstack.append(xelement)
+            continue
+        
+        xstack.pop()
+        xparent = xstack[-1].tag if xstack else None
+        
+        if xparent == "images" and xelement.tag == "image":
+            ximgs[xelement.attrib["name"]] = xelement
+        elif xparent == "texts" and xelement.tag == "text":
+            text_names[xelement.attrib.get("path")] = xelement.attrib["name"]
+        elif (xparent == "groups" and xelement.tag == "group") or (xparent == "blib" and xelement.tag == "main"):
+            used = (set(), set(), set(), set())
+            xnodes = xelement.find("nodes")
+            for xnode in (xnodes if xnodes is not None else []):
+                for i, attr in enumerate(("blib_node_tree", "blib_image", "blib_script", "blib_filepath")):
+                    if attr in xnode.attrib:
+                        used[i].add(xnode.attrib[attr])
+                if "blib_text" in xnode.attrib:
+                    used[2].add(xnode.attrib["blib_text"])
+            uses[(xelement.tag, xelement.attrib["name"])] = used
+    xml_file.close()
+    
+    #Follow the node groups used by the selected assets, visiting each only once
+    pending = [key for key in uses if key[1] in names]
+    selected = set(pending)
+    while pending:
+        for grp in uses[pending.pop()][0]:
+            if ("group", grp) in uses and ("group", grp) not in selected:
+                selected.add(("group", grp))
+                pending.append(("group", grp))
+    
+    images = set()
+    texts = set()
+    scripts = set()
+    for key in selected:
+        images.update(uses[key][1])
+        texts.update(uses[key][2])
+        scripts.update(uses[key][3])
+    
+    #Scripts referenced by path are shared with the external texts stored at the same path
+    texts.update(text_names[spath] for spath in scripts if spath in text_names)
+    
+    return {
+        "groups": {name for tag, name in selected if tag == "group"},
+        "main": any(tag == "main" for tag, name in selected),
+        "images": {name: ximgs[name] for name in images if name in ximgs},
+        "texts": texts,
+        "paths": scripts | {tpath for tpath, name in text_names.items() if name in texts and tpath is not None},
+        "missing": set(names) - {name for tag, name in selected},
+        "events": events,
+    }
 
 def bimport(filepath, resource_path=None, imgi_import=True, imge_import=True, seq_import=True, mov_import=True, txti_import=True, txte_import=True,
-            script_import=True, img_embed=False, txt_embed=None, skip_sha1=False, img_merge=True):
+            script_import=True, img_embed=False, txt_embed=None, skip_sha1=False, img_merge=True, threads=0, asset=None, sub_type=None, names=None):
     """
     Import a Cycles material or node group from a .blib or .xml file.
+    From a bundle, only the members of the imported asset are read.
     
     Args:
-        filepath (str): Path to .blib or .xml file.
+        filepath (str or blib.utils.BlibFile): Path to .blib or .xml file, or an already open .blib file.
+            A passed 'BlibFile' is not closed.
         resource_path (str or None): Custom path to save external resources or None to keep the default path.
         imgi_import (bool): Import images that were packed in .blend file.
         imge_import (bool): Import images that were externally saved.
@@ -341,17 +705,35 @@ def bimport(filepath, resource_path=None, imgi_import=True, imge_import=True, se
             materials, that would otherwise seem corrupted (use with caution).
         img_merge (bool): If an image contained in the .blib, is already available in the local
             resources, use the existing image instead of creating a new instance.
+        threads (int): Number of threads used to extract files, and to check the integrity of the files that are not extracted,
+            0 to use one thread per CPU core. Extracted files are checked while extracting.
+        asset (str or None): Name of the asset to be imported from a bundle,
+            can be None if the bundle only contains one asset. Ignored for single asset files.
+        sub_type (str or None): Blib sub-type of the asset to be imported from a bundle ("mat" or "grp"),
+            to tell apart a material and a node group with the same name, or None to match any sub-type.
+        names (list[str] or None): Names of the node groups and/or material to be imported,
+            along with the groups, images, texts and scripts they use, or None to import everything.
+            Nothing else is built or extracted, and only the needed files are checked.
     
     Returns:
         bpy.types.Material or bpy.types.ShaderNodeTree
         The produced material or node tree.
     
     Raises:
-        blib.exeptions.InvalidBlibFile: If the file is not a valid Blender Library.
+        blib.exeptions.InvalidBlibFile: If the file is not a valid Blender Library, or contains none of the requested 'names'.
         blib.exeptions.BlibTypeError: If the Blender Library is not of type "cycles".
         blib.exeptions.BlibVersionError: If the file was created with a later, backwards incompatible version of Blib.
     """
     
+    if isinstance(filepath, BlibFile):
+        blib_file = filepath
+        filepath = blib_file.path
+    elif path.splitext(filepath)[1] == ".blib":
+        #Open the file here, so that it is closed however the import ends
+        with BlibFile(bpy.path.abspath(filepath)) as blib_file:
+            return bimport(blib_file, resource_path, imgi_import, imge_import, seq_import, mov_import, txti_import, txte_import,
+                           script_import, img_embed, txt_embed, skip_sha1, img_merge, threads, asset, sub_type, names)
+    
     filepath = bpy.path.abspath(filepath) #Ensure path is absolute
     
     if resource_path is None or resource_path.strip() == "":
@@ -360,58 +742,82 @@ def bimport(filepath, resource_path=None, imgi_import=True, imge_import=True, se
         resource_path = bpy.path.abspath(resource_path) #Ensure path is absolute
     
     if path.splitext(filepath)[1] == ".blib":
-        try:
-            archive = zf.ZipFile(filepath, 'r')
-        except zf.BadZipFile:
+        archive = blib_file.archive
+        if archive is None:
             raise InvalidBlibFile("File is not a valid Blender library")
         
         blib = True
         try:
-            file_checksum, blibtype, file_version, compatible, *rest = archive.comment.decode("utf-8").split(" ")
+            file_checksum, blibtype, file_version, compatible, *rest = blib_file.meta
         except ValueError:
             raise InvalidBlibFile("File is broken, missing meta-data")
         
         compatible = Version(compatible)
         
+        #The integrity of the files themselves is checked before creating any datablock
         if blibtype == "cycles":
             if compatible <= version:
-                if archive.testzip() is not None:
-                    raise InvalidBlibFile("File is broken")
-                else:
-                    if not skip_sha1:
-                        checksum = archive_sha1(archive)
-                        
-                        if not file_checksum == checksum.hexdigest():
-                            raise InvalidBlibFile("Checksum does not match, file may be broken or have been altered\n"
-                                                  'Run with "skip_sha1" to ignore checksum')
+                if not skip_sha1:
+                    #Computed only once per open file, when importing several assets from a bundle
+                    if not file_checksum == blib_file.checksum:
+                        raise InvalidBlibFile("Checksum does not match, file may be broken or have been altered\n"
+                                              'Run with "skip_sha1" to ignore checksum')
             else:
                 raise BlibVersionError("File has incompatible version of blib")
         else:
             raise BlibTypeError("File is not a valid Cycles material")
+        
+        #Load the reference table once, before it is used by the extraction threads
         try:
-            xml_file = archive.open("structure.xml", 'r')
-        except KeyError:
+            references(archive)
+        except zf.BadZipFile:
+            raise InvalidBlibFile("File is broken")
+        
+        structure = "structure.xml"
+        members = list(blib_file.members)
+        if rest and rest[0] == "bundle":
+            assets = read_index(blib_file)
+            if assets is None:
+                raise InvalidBlibFile("File is broken, missing bundle index")
+            if asset is None and len(assets) > 1:
+                raise InvalidBlibFile("File is a bundle of several assets, the name of the asset to import is required")
+            assets = [entry for entry in assets if (asset is None or entry["name"] == asset) and
+                                                   (sub_type is None or entry["sub_type"] == sub_type)]
+            if not assets:
+                raise InvalidBlibFile("Bundle contains no asset named '{}'".format(asset))
+            structure = assets[0]["path"]
+            members = blib_file.asset_members.get(structure.rsplit("/", 1)[0] + "/", [])
+        
+        if structure not in blib_file.members:
             raise InvalidBlibFile("File is broken, missing structure XML")
-        tree = ET.ElementTree(file=xml_file)
-        xml_file.close()
-        xroot = tree.getroot()
+        try:
+            xml_file = archive.open(structure, 'r')
+        except zf.BadZipFile:
+            raise InvalidBlibFile("File is broken")
     
     elif path.splitext(filepath)[1] == ".xml":
-        tree = ET.ElementTree(file=filepath)
-        xroot = tree.getroot()
+        xml_file = open(filepath, 'rb')
+        archive = None
         blib = False
-        xversion = Version(xroot.attrib["compatible"])
-        if xversion > version:
-            raise BlibVersionError("File has incompatible version of blib")
     
     else:
         raise InvalidBlibFile("File is not a Blender library")
     
-    if xroot.tag != "blib":
-        raise InvalidBlibFile("File is not a Blender library")
-    
-    if xroot.attrib["type"] != "cycles":
-        raise BlibTypeError("File is not a valid Cycles material")
+    #Read the structure once ahead, to only build and check what the selected assets depend on
+    selection = None
+    if names is not None:
+        selection = select_assets(xml_file, names)
+        if len(selection["missing"]) == len(set(names)):
+            raise InvalidBlibFile("File contains none of the assets: {}".format(", ".join(sorted(selection["missing"]))))
+        
+        if blib:
+            needed = {structure} | image_members(archive, selection["images"].values())
+            for spath in selection["paths"]:
+                try:
+                    needed.add(get_path(archive, spath))
+                except KeyError:
+                    pass
+            members = [name for name in members if name in needed]
     
     failed = {}
     imgs = {}
@@ -419,247 +825,310 @@ def bimport(filepath, resource_path=None, imgi_import=True, imge_import=True, se
     txt_paths = {}
     grps = {}
     scripts = {}
+    structs = {}
+    kept = {}
     resources = {
         "images": imgs,
         "texts": txts,
         "text_paths": txt_paths,
         "groups": grps,
         "scripts": scripts,
+        "structs": structs,
+        "kept": kept,
     }
     txt_dir = ResourceDir("texts", resource_path)
-    xres = xroot.find("resources")
-    
-    #Import resources
-    if xres is not None:
-        ximgs = xres.find("images")
-        xtxts = xres.find("texts")
-        xgrps = xres.find("groups")
-        tmp_path = ResourceDir("tmp", resource_path)
-        path_dict = {}
-        
-        #Images
-        if ximgs is not None and (imgi_import or imge_import or seq_import or mov_import) and blib:
-            img_dir = ResourceDir("images", resource_path)
-            hash_dict = None
-            sfv_update = False
-            for ximg in ximgs:
-                if ximg.attrib["source"] in {'FILE', 'GENERATED'}:
-                    if ximg.attrib["origin"] == "internal":
-                        if not imgi_import:
-                            pass
-                    else:
-                        if not imge_import:
-                            pass
-                elif ximg.attrib["source"] == 'SEQUENCE':
-                    if not seq_import:
-                        pass
-                elif ximg.attrib["source"] == 'MOVIE':
-                    if not mov_import:
-                        pass
-                
-                #Write image to temporary folder, and pack in Blender
-                if ximg.attrib["source"] in {'FILE', 'GENERATED'} and (img_embed or (img_embed is None and ximg.attrib["origin"] == "internal")):
-                    ipath = extract_image(archive, ximg.attrib["path"], str(tmp_path), path_dict, failed)
-                    if ipath is None:
-                        pass
+    
+    img_import = False
+    tmp_path = ResourceDir("tmp", resource_path)
+    img_dir = ResourceDir("images", resource_path)
+    path_dict = {}
+    store = None
+    extractor = Extractor(archive, threads) if blib else None
+    loads = []
+    added = []
+    verifier = None
+    verified = not blib
+    mat = None
+    grp = None
+    
+    #Build every resource and the material as soon as its element is parsed, and drop it once built,
+    #so that only the element being built is held in memory, instead of the whole structure
+    xstack = []
+    try:
+        #The structure was already parsed to select the assets
+        for event, xelement in (parse_structure(xml_file) if selection is None else selection.pop("events")):
+            if event == "start":
+                if not xstack:
+                    if xelement.tag != "blib":
+                        raise InvalidBlibFile("File is not a Blender library")
                     
-                    try:
-                        img = bpy.data.images.load(ipath)
-                    except:
-                        fail(failed, "images", "import image '{}', unknown reason".format(ximg.attrib["path"]))
-                    else:
-                        img.source = ximg.attrib["source"]
-                        try:
-                            img.pack()
-                        except:
-                            bpy.data.images.remove(img)
-                            fail(failed, "images", "pack image '{}', unknown reason".format(ximg.attrib["path"]))
-                        else:
-                            img.filepath = ""
-                            imgs[ximg.attrib["name"]] = img
+                    if xelement.attrib["type"] != "cycles":
+                        raise BlibTypeError("File is not a valid Cycles material")
+                    
+                    if not blib and Version(xelement.attrib["compatible"]) > version:
+                        raise BlibVersionError("File has incompatible version of blib")
+                xstack.append(xelement)
+                continue
+            
+            xstack.pop()
+            xparent = xstack[-1].tag if xstack else None
+            
+            if xparent == "resources" and xelement.tag == "images":
+                if selection is not None:
+                    for ximg in list(xelement):
+                        if ximg.attrib["name"] not in selection["images"]:
+                            xelement.remove(ximg)
                 
-                else: #Write image to resource folder, and load in Blender
-                    if img_merge and ximg.attrib["source"] != 'SEQUENCE': #Use existing image in resources if available
-                        try:
-                            comment = archive.getinfo(ximg.attrib["path"]).comment.decode("utf-8")
-                        except KeyError:
-                            fail(failed, "images", "import image '{}', file is missing".format(ximg.attrib["path"]))
-                            pass
-                        
-                        com_path = path_dict[comment] if comment != "" else ""
-                        com_name = path.basename(path.dirname(com_path))
-                        if comment != "" and com_name != "tmp":
-                            ipath = com_path
-                            path_dict[ximg.attrib["path"]] = ipath
-                        else:
-                            #Create hash dictionary only in the first iteration
-                            if hash_dict is None:
-                                hash_path = path.join(img_dir.root, "list.sfv")
-                                hash_dict = {}
-                                if path.isfile(hash_path):
-                                    sfv = re.compile(r"(.*) (.*?)$")
-                                    hash_file = open(hash_path, 'r', encoding="utf-8")
-                                    for line in hash_file:
-                                        key = sfv.sub(r"\2", line).strip()
-                                        val = sfv.sub(r"\1", line).strip()
-                                        if key in hash_dict and val in hash_dict[key]:
-                                            sfv_update = True
-                                        else:
-                                            hash_dict.setdefault(key, []).append(val)
-                                    hash_file.close()
-                                hash_bkp = hash_dict.copy()
-                            
-                            #Check if files match and set path to appropriate image
-                            img_path = ximg.attrib["path"] if comment == "" else comment
-                            try:
-                                crc = format(archive.getinfo(img_path).CRC, 'x')
-                            except KeyError:
-                                fail(failed, "images", "import image '{}', file is missing".format(ximg.attrib["path"]))
-                                pass
-                            
-                            if crc in hash_dict:
-                                i = 0
-                                while i < len(hash_dict[crc]):
-                                    val = hash_dict[crc][i]
-                                    fpath = path.join(img_dir.root, val)
-                                    if path.isfile(fpath):
-                                        fsize = path.getsize(fpath)
-                                        zsize = archive.getinfo(img_path).file_size
-                                        if fsize == zsize:
-                                            ffile = open(fpath, 'rb')
-                                            zfile = archive.open(img_path, 'r')
-                                            if files_equal(ffile, zfile):
-                                                ipath = fpath
-                                                path_dict[ximg.attrib["path"]] = ipath
-                                                ffile.close()
-                                                zfile.close()
-                                                break
-                                            ffile.close()
-                                            zfile.close()
-                                    else:
-                                        hash_dict[crc].remove(val)
-                                        i -= 1
-                                    i += 1
+                img_import = (imgi_import or imge_import or seq_import or mov_import) and blib
+                
+                #Check integrity of all files that are not extracted with the images, on a thread pool,
+                #while the extracted images are checked as they are extracted, so that each file is only read once
+                if blib:
+                    extracted = image_members(archive, xelement) if img_import else set()
+                    checked = [name for name in members if name not in extracted]
+                    verifier = Verifier(archive, checked, threads, text_members(checked))
+                
+                #Extract images on the thread pool, the datablocks are only created once all are extracted
+                if img_import:
+                    try:
+                        for ximg in xelement:
+                            if ximg.attrib["source"] in {'FILE', 'GENERATED'}:
+                                if ximg.attrib["origin"] == "internal":
+                                    if not imgi_import:
+                                        pass
                                 else:
-                                    ipath = extract_image(archive, ximg.attrib["path"], str(img_dir), path_dict, failed)
-                                    if ipath is None:
+                                    if not imge_import:
                                         pass
-                                    
-                                    hash_dict[crc].append(path.relpath(ipath, img_dir.root))
-                            else:
-                                ipath = extract_image(archive, ximg.attrib["path"], str(img_dir), path_dict, failed)
+                            elif ximg.attrib["source"] == 'SEQUENCE':
+                                if not seq_import:
+                                    pass
+                            elif ximg.attrib["source"] == 'MOVIE':
+                                if not mov_import:
+                                    pass
+                            
+                            #Write image to temporary folder, and pack in Blender
+                            if ximg.attrib["source"] in {'FILE', 'GENERATED'} and (img_embed or (img_embed is None and ximg.attrib["origin"] == "internal")):
+                                ipath = extract_image(extractor, ximg.attrib["path"], str(tmp_path), path_dict, failed)
                                 if ipath is None:
                                     pass
                                 
-                                hash_dict[crc] = [path.relpath(ipath, img_dir.root)]
-                    else: #Use image in archive, even if duplicate
-                        if ximg.attrib["source"] == 'SEQUENCE':
-                            seq_dir = path.dirname(ximg.attrib["path"])
-                            dir_name = ximg.attrib["path"].split("/")[-2]
-                            seq_path = path.join(str(img_dir), dir_name)
-                            makedirs(seq_path)
-                            seq_imgs = [img for img in archive.namelist() if img.startswith(seq_dir)]
-                            for img in seq_imgs:
-                                i_tmp_path = extract_image(archive, img, seq_path, path_dict, failed)
-                                if img == ximg.attrib["path"]:
-                                    ipath = i_tmp_path
-                                    if ipath is None:
-                                        break
-                            if ipath is None:
-                                rmtree(seq_path)
-                                pass
-                        else:
-                            ipath = extract_image(archive, ximg.attrib["path"], str(img_dir), path_dict, failed)
-                            if ipath is None:
-                                pass
-                    
-                    #load image to Blender
-                    try:
-                        img = bpy.data.images.load(ipath)
+                                loads.append((ximg, ipath, True))
+                            
+                            else: #Write image to resource folder, and load in Blender
+                                if img_merge and ximg.attrib["source"] != 'SEQUENCE': #Use existing image in resources if available
+                                    try:
+                                        comment = get_path(archive, ximg.attrib["path"])
+                                        comment = "" if comment == ximg.attrib["path"] else comment
+                                    except KeyError:
+                                        fail(failed, "images", "import image '{}', file is missing".format(ximg.attrib["path"]))
+                                        pass
+                                    
+                                    #In bundles, the referenced file can belong to an asset that is not imported
+                                    com_path = path_dict.get(comment, "") if comment != "" else ""
+                                    com_tmp = bool(tmp_path) and path.dirname(com_path) == str(tmp_path)
+                                    if com_path != "" and not com_tmp:
+                                        ipath = com_path
+                                        path_dict[ximg.attrib["path"]] = ipath
+                                    else:
+                                        #Open resource index only in the first iteration
+                                        if store is None:
+                                            store = ResourceStore(img_dir.root)
+                                        
+                                        #Check if files match and set path to appropriate image
+                                        img_path = ximg.attrib["path"] if comment == "" else comment
+                                        try:
+                                            ipath = store.find(archive, img_path)
+                                        except KeyError:
+                                            fail(failed, "images", "import image '{}', file is missing".format(ximg.attrib["path"]))
+                                            pass
+                                        
+                                        if ipath is not None:
+                                            path_dict[ximg.attrib["path"]] = ipath
+                                        else:
+                                            ipath = extract_image(extractor, ximg.attrib["path"], str(img_dir), path_dict, failed)
+                                            if ipath is None:
+                                                pass
+                                            
+                                            added.append((ipath, archive.getinfo(img_path).CRC))
+                                else: #Use image in archive, even if duplicate
+                                    if ximg.attrib["source"] == 'SEQUENCE':
+                                        seq_dir = path.dirname(ximg.attrib["path"])
+                                        dir_name = ximg.attrib["path"].split("/")[-2]
+                                        seq_path = path.join(str(img_dir), dir_name)
+                                        makedirs(seq_path)
+                                        seq_imgs = [img for img in member_names(archive) if img.startswith(seq_dir)]
+                                        for img in seq_imgs:
+                                            i_tmp_path = extract_image(extractor, img, seq_path, path_dict, failed)
+                                            if img == ximg.attrib["path"]:
+                                                ipath = i_tmp_path
+                                                if ipath is None:
+                                                    break
+                                        if ipath is None:
+                                            extractor.wait()
+                                            rmtree(seq_path)
+                                            pass
+                                    else:
+                                        ipath = extract_image(extractor, ximg.attrib["path"], str(img_dir), path_dict, failed)
+                                        if ipath is None:
+                                            pass
+                                
+                                loads.append((ximg, ipath, False))
+                        
+                        extractor.wait()
+                        for ipath, crc in added:
+                            store.add(ipath, crc)
+                    except (zf.BadZipFile, zlib.error):
+                        extractor.close()
+                        verifier.close()
+                        discard_extracted(img_dir, tmp_path, store)
+                        raise InvalidBlibFile("File is broken")
                     except:
-                        fail(failed, "images", "import image '{}', unknown reason".format(ximg.attrib["path"]))
-                    else:
-                        img.source = ximg.attrib["source"]
-                        imgs[ximg.attrib["name"]] = img
+                        #E.g. the disk being full, the partly extracted files are removed all the same
+                        extractor.close()
+                        verifier.close()
+                        discard_extracted(img_dir, tmp_path, store)
+                        raise
+            elif not ((xparent == "resources" and xelement.tag == "texts") or (xparent == "groups" and xelement.tag == "group")
+                      or (xparent == "blib" and xelement.tag == "main")):
+                continue
             
-            if tmp_path:
-                for item in listdir(str(tmp_path)):
-                    fpath = path.join(str(tmp_path), item)
-                    if path.isfile(fpath):
-                        remove(fpath)
+            elif selection is not None and xelement.tag == "texts":
+                for xtxt in list(xelement):
+                    if xtxt.attrib["name"] not in selection["texts"]:
+                        xelement.remove(xtxt)
             
-            #Update hash file if list has changed
-            if hash_dict is not None and (hash_dict != hash_bkp or sfv_update):
-                hash_path = path.join(img_dir.root, "list.sfv")
-                hash_file = open(hash_path, 'w', encoding="utf-8")
-                for key in hash_dict:
-                    for val in hash_dict[key]:
-                        hash_file.write(val + " " + key + "\n")
-                hash_file.close()
-        
-        #Texts
-        if xtxts is not None and (txti_import or txte_import):
-            for xtxt in xtxts:
-                if xtxt.attrib["origin"] == "internal":
-                    if txti_import:
-                        if "path" in xtxt.attrib:
-                            if blib:
+            elif selection is not None and not (selection["main"] if xelement.tag == "main" else
+                                                xelement.attrib["name"] in selection["groups"]):
+                #Attribute structures are only defined where first used, which can be in a skipped asset
+                read_structs(xelement, structs)
+                xstack[-1].remove(xelement)
+                continue
+            
+            #Report broken files before creating any datablock
+            if not verified:
+                if verifier is None:
+                    verifier = Verifier(archive, members, threads, text_members(members))
+                if verifier.result() is not None:
+                    xml_file.close()
+                    extractor.close()
+                    discard_extracted(img_dir, tmp_path, store)
+                    raise InvalidBlibFile("File is broken")
+                kept.update(verifier.kept)
+                verified = True
+            
+            if xelement.tag == "images":
+                if img_import:
+                    #Load images to Blender
+                    for ximg, ipath, pack in loads:
+                        try:
+                            img = bpy.data.images.load(ipath)
+                        except:
+                            fail(failed, "images", "import image '{}', unknown reason".format(ximg.attrib["path"]))
+                        else:
+                            img.source = ximg.attrib["source"]
+                            if pack:
+                                try:
+                                    img.pack()
+                                except:
+                                    bpy.data.images.remove(img)
+                                    fail(failed, "images", "pack image '{}', unknown reason".format(ximg.attrib["path"]))
+                                else:
+                                    img.filepath = ""
+                                    imgs[ximg.attrib["name"]] = img
+                            else:
+                                imgs[ximg.attrib["name"]] = img
+                    
+                    if tmp_path:
+                        rmtree(str(tmp_path))
+                    
+                    #Save new images to the resource index
+                    if store is not None:
+                        store.commit()
+                        store.close()
+            
+            elif xelement.tag == "texts":
+                #Work out how each text is imported
+                jobs = []
+                for xtxt in xelement:
+                    if xtxt.attrib["origin"] == "internal":
+                        if txti_import:
+                            if "path" in xtxt.attrib:
+                                if blib:
+                                    if txt_embed == False:
+                                        jobs.append(("zip", "ext", xtxt, None))
+                                    else:
+                                        jobs.append(("zip", "int", xtxt, None))
+                            else:
                                 if txt_embed == False:
-                                    import_texts("zip", "ext", xtxt, txts, failed, archive, txt_dir)
+                                    jobs.append(("xml", "ext", xtxt, None))
                                 else:
-                                    import_texts("zip", "int", xtxt, txts, failed, archive, txt_dir)
-                        else:
-                            if txt_embed == False:
-                                import_texts("xml", "ext", xtxt, txts, failed, None, txt_dir)
+                                    jobs.append(("xml", "int", xtxt, None))
+                    
+                    else:
+                        if txte_import:
+                            if "path" in xtxt.attrib:
+                                if blib:
+                                    if txt_embed == True:
+                                        jobs.append(("zip", "int", xtxt, txt_paths))
+                                    else:
+                                        jobs.append(("zip", "ext", xtxt, txt_paths))
                             else:
-                                import_texts("xml", "int", xtxt, txts, failed, None, txt_dir)
-                
-                else:
-                    if txte_import:
-                        if "path" in xtxt.attrib:
-                            if blib:
                                 if txt_embed == True:
-                                    import_texts("zip", "int", xtxt, txts, failed, archive, txt_dir, txt_paths)
+                                    jobs.append(("xml", "int", xtxt, txt_paths))
                                 else:
-                                    import_texts("zip", "ext", xtxt, txts, failed, archive, txt_dir, txt_paths)
-                        else:
-                            if txt_embed == True:
-                                import_texts("xml", "int", xtxt, txts, failed, None, txt_dir, txt_paths)
-                            else:
-                                import_texts("xml", "ext", xtxt, txts, failed, None, txt_dir, txt_paths)
-        
-        #Groups
-        if xgrps is not None:
-            for xgrp in xgrps:
-                xnodes = xgrp.find("nodes")
-                xlinks = xgrp.find("links")
-                grp = bpy.data.node_groups.new(xgrp.attrib["name"], xgrp.attrib["bl_idname"])
-                grps[xgrp.attrib["name"]] = grp
+                                    jobs.append(("xml", "ext", xtxt, txt_paths))
+                
+                #Write the texts saved externally from the data read while verifying them,
+                #extracting any other ones on the thread pool, then create all datablocks
+                extracted = {}
+                for orig, dest, xtxt, paths in jobs:
+                    if orig == "zip" and dest == "ext":
+                        try:
+                            extracted[xtxt.attrib["path"]] = write_text(archive, xtxt.attrib["path"], str(txt_dir), kept, extractor)
+                        except KeyError:
+                            pass
+                if extracted:
+                    extractor.wait()
+                
+                for orig, dest, xtxt, paths in jobs:
+                    import_texts(orig, dest, xtxt, txts, failed, archive if orig == "zip" else None, txt_dir, paths, extracted, kept)
+            
+            elif xelement.tag == "group":
+                read_structs(xelement, structs)
+                xnodes = xelement.find("nodes")
+                xlinks = xelement.find("links")
+                grp = bpy.data.node_groups.new(xelement.attrib["name"], xelement.attrib["bl_idname"])
+                grps[xelement.attrib["name"]] = grp
                 if xnodes is not None:
                     build_tree(xnodes, xlinks, grp, resources, txt_embed, txt_dir, blib, script_import, archive, failed)
+            
+            else:
+                read_structs(xelement, structs)
+                xcycles = xelement.find("cycles_settings")
+                xnodes = xelement.find("nodes")
+                xlinks = xelement.find("links")
+                
+                mat = bpy.data.materials.new(xelement.attrib["name"])
+                set_attributes(mat, xelement, failed, structs)
+                set_attributes(mat.cycles, xcycles, failed, structs)
+                mat.use_nodes = True
+                mat.node_tree.nodes.clear()
+                build_tree(xnodes, xlinks, mat.node_tree, resources, txt_embed, txt_dir, blib, script_import, archive, failed)
+            
+            xstack[-1].remove(xelement)
+    finally:
+        #Release the file and the worker threads, also when the file turns out to be invalid
+        xml_file.close()
+        if extractor is not None:
+            extractor.close()
+        if verifier is not None:
+            verifier.close()
+        if store is not None:
+            store.close()
     
-    #Import material
-    xmat = xroot.find("main")
-    
-    if xmat is not None:
-        xcycles = xmat.find("cycles_settings")
-        xnodes = xmat.find("nodes")
-        xlinks = xmat.find("links")
-        
-        mat = bpy.data.materials.new(xmat.attrib["name"])
-        set_attributes(mat, xmat, failed)
-        set_attributes(mat.cycles, xcycles, failed)
-        mat.use_nodes = True
-        mat.node_tree.nodes.clear()
-        build_tree(xnodes, xlinks, mat.node_tree, resources, txt_embed, txt_dir, blib, script_import, archive, failed)
-        if blib:
-            archive.close()
-        for f in failed:
-            print("{} {} failed to be imported/assigned.".format(failed[f], f))
-        return mat
-    else:
-        if blib:
-            archive.close()
-        for f in failed:
-            print("{} {} failed to be imported/assigned.".format(failed[f], f))
-        return grp
+    if selection is not None:
+        for name in sorted(selection["missing"]):
+            fail(failed, "assets", "import asset '{}', not in file".format(name))
+    for f in failed:
+        print("{} {} failed to be imported/assigned.".format(failed[f], f))
+    return mat if mat is not None else grp
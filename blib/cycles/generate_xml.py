@@ -21,11 +21,16 @@
 
 import bpy
 
+import sys
+import json
+from copy import deepcopy
 import xml.etree.cElementTree as ET
 from os import path
+from array import array
+from base64 import b64encode
 
 from .version import version, compatible
-from .utils import check_asset
+from .utils import check_asset, group_graph, group_order
 from ..utils import fail
 
 ##### Pretty print code by Fredrik Lundh. Source: http://effbot.org/zone/element-lib.htm#prettyprint #####
@@ -45,35 +50,158 @@ def indent(elem, level=0):
             elem.tail = i
 ##### End of pretty print code #####
 
+#Serialization plans, cached for the session by type (see 'get_plan')
+plans = {}
+
+def get_plan(asset):
+    """
+    Get the serialization plan for the type of 'asset', building it on first use.
+    
+    The plan holds the names of the attributes to be considered for export,
+    and which of them are writable, which is only probed once per type and attribute.
+    
+    Args:
+        asset (bpy.types.bpy_struct): The object to be serialized.
+    
+    Returns:
+        (attrs, writable)
+        attrs (list[str]): Names of the attributes to be considered for export, in export order.
+        writable (dict): Dictionary mapping the attribute names that were already probed, to their writability.
+    """
+    
+    key = (type(asset), asset.type if hasattr(asset, "type") else None)
+    plan = plans.get(key)
+    if plan is None:
+        attrs = []
+        for attr in dir(asset):
+            if not attr.startswith("__") and not attr.startswith("bl_") and \
+               not (attr == "node_tree" and key[1] == 'GROUP') and \
+               not (attr in {"filepath", "script"} and key[1] == 'SCRIPT') and \
+               not (attr == "text" and key[1] == 'FRAME') and \
+               not (attr == "image" and hasattr(asset, "image_user")):
+                attrs.append(attr)
+        plan = (attrs, {})
+        plans[key] = plan
+    return plan
+
 def set_attributes(asset, xelement, optimize_file):
-    attrs = [attr for attr in dir(asset) if not attr.startswith("__") and not attr.startswith("bl_") and type(getattr(asset, attr)).__module__ == "builtins"]
+    attrs, writable = get_plan(asset)
+    types = []
     for attr in attrs:
-        if not (attr == "node_tree" and hasattr(asset, "type") and asset.type == 'GROUP') and \
-           not (attr in {"filepath", "script"} and hasattr(asset, "type") and asset.type == 'SCRIPT') and \
-           not (attr == "text" and hasattr(asset, "type") and asset.type == 'FRAME') and \
-           not (attr == "image" and hasattr(asset, "image_user")):
-            val = getattr(asset, attr)
+        val = getattr(asset, attr)
+        if type(val).__module__ != "builtins":
+            continue
+        
+        #Only attributes that can be written back are exported
+        if attr not in writable:
             try:
                 setattr(asset, attr, val)
             except AttributeError:
+                writable[attr] = False
+            else:
+                writable[attr] = True
+        if not writable[attr]:
+            continue
+        
+        if isinstance(val, str) or isinstance(val, int) or isinstance(val, float) or isinstance(val, bool) or val is None:
+            if not (optimize_file and (val == "" or val is None)):
+                set_value(xelement, attr, val, types)
+        elif isinstance(val, set):
+            set_value(xelement, attr, val, types)
+        else:
+            try:
+                val = list(val)
+            except TypeError:
                 pass
             else:
-                if isinstance(val, str) or isinstance(val, int) or isinstance(val, float) or isinstance(val, bool) or val is None:
-                    if not (optimize_file and (val == "" or val is None)):
-                        xelement.set(attr, str(val))
-                else:
-                    try:
-                        val = list(val)
-                    except TypeError:
-                        pass
-                    else:
-                        xelement.set(attr, str(val))
+                set_value(xelement, attr, val, types)
+    
+    if types:
+        xelement.set("blib_types", " ".join(types))
     return
 
-def set_io(asset, xelement, optimize_file):
+def encode_value(val):
+    """
+    Encode a value as a typed attribute.
+    
+    Type codes: "b" bool, "i" int, "f" float, "s" str, "n" None, "B", "I" and "F" space separated
+    arrays of bools, ints and floats, "E" space separated set of enum items, and "j" any other list,
+    encoded as JSON. Bools are encoded as "1" or "0".
+    
+    Args:
+        val (bool, int, float, str, list, set or None): The value to be encoded.
+    
+    Returns:
+        (code, string) or None
+        code (str): The type code.
+        string (str): The encoded value.
+        None is returned if the value can't be encoded.
+    """
+    
+    if isinstance(val, bool):
+        return "b", "1" if val else "0"
+    elif isinstance(val, int):
+        return "i", str(val)
+    elif isinstance(val, float):
+        return "f", repr(val)
+    elif isinstance(val, str):
+        return "s", val
+    elif val is None:
+        return "n", ""
+    elif isinstance(val, set):
+        return "E", " ".join(sorted(val))
+    
+    if val:
+        if all(isinstance(item, bool) for item in val):
+            return "B", " ".join("1" if item else "0" for item in val)
+        elif all(isinstance(item, int) and not isinstance(item, bool) for item in val):
+            return "I", " ".join(str(item) for item in val)
+        elif all(isinstance(item, (int, float)) and not isinstance(item, bool) for item in val):
+            return "F", " ".join(repr(item) for item in val)
+    try:
+        return "j", json.dumps(val, default=list)
+    except (TypeError, ValueError):
+        return None
+
+def set_value(xelement, attr, val, types):
+    """Set a typed attribute on 'xelement', and add its type to the list of types of the element."""
+    
+    encoded = encode_value(val)
+    if encoded is not None:
+        xelement.set(attr, encoded[1])
+        types.append(attr + ":" + encoded[0])
+
+def number_structs(xroot, structs=None):
+    """
+    Replace the type lists of the elements with numbered structures, so that each type list is only stored once.
+    
+    The first element (in document order) of each structure holds its type list ("blib_types")
+    as well as its number ("blib_struct"), while the following ones only hold the number.
+    
+    Args:
+        xroot (xml.etree.ElementTree.Element): Root element of the structure XML (or of part of it).
+        structs (dict or None): Dictionary mapping the type lists to their numbers, shared by all parts
+            of the structure XML when it is numbered part by part, in document order.
+    """
+    
+    if structs is None:
+        structs = {}
+    for xelement in xroot.iter():
+        types = xelement.attrib.pop("blib_types", None)
+        if types is not None:
+            if types in structs:
+                xelement.set("blib_struct", structs[types])
+            else:
+                structs[types] = str(len(structs))
+                xelement.set("blib_struct", structs[types])
+                xelement.set("blib_types", types)
+
+def set_io(asset, xelement, optimize_file, socket_map=None):
     if len(asset.inputs) > 0:
         xins = ET.SubElement(xelement, "inputs")
-        for inp in asset.inputs:
+        for i, inp in enumerate(asset.inputs):
+            if socket_map is not None:
+                socket_map[inp.as_pointer()] = i
             if inp.identifier == '__extend__':
                 break
             xin = ET.SubElement(xins, "input")
@@ -81,73 +209,453 @@ def set_io(asset, xelement, optimize_file):
     
     if len(asset.outputs) > 0:
         xouts = ET.SubElement(xelement, "outputs")
-        for out in asset.outputs:
+        for i, out in enumerate(asset.outputs):
+            if socket_map is not None:
+                socket_map[out.as_pointer()] = i
             if out.identifier == '__extend__':
                 break
             xout = ET.SubElement(xouts, "output")
             set_attributes(out, xout, optimize_file)
     return
 
-def set_nodes(asset, xelement, images, script_export, scr_paths, textnames, optimize_file):
-    if len(asset.nodes) > 0:
-        xnodes = None
-        for node in asset.nodes:
-            if xnodes == None:
-                xnodes = ET.SubElement(xelement, "nodes")
-            
-            xnode = ET.SubElement(xnodes, "node")
-            xnode.set("bl_idname", node.bl_idname)
-            if node.parent is not None:
-                xnode.set("blib_parent", node.parent.name)
-            set_attributes(node, xnode, optimize_file)
-            set_io(node, xnode, optimize_file)
-            
-            if node.type == 'GROUP':
-                if node.node_tree is not None:
-                    xnode.set("blib_node_tree", node.node_tree.name)
-            elif node.type == 'SCRIPT':
-                if node.mode == 'INTERNAL':
-                    if node.script is not None and node.script.name in textnames:
-                        xnode.set("blib_script", node.script.name)
-                elif node.mode == 'EXTERNAL':
+def gen_node(node, images, scr_paths, textnames, optimize_file, socket_map=None):
+    xnode = ET.Element("node")
+    xnode.set("bl_idname", node.bl_idname)
+    if node.parent is not None:
+        xnode.set("blib_parent", node.parent.name)
+    set_attributes(node, xnode, optimize_file)
+    set_io(node, xnode, optimize_file, socket_map)
+    
+    if node.type == 'GROUP':
+        if node.node_tree is not None:
+            xnode.set("blib_node_tree", node.node_tree.name)
+    elif node.type == 'SCRIPT':
+        if node.mode == 'INTERNAL':
+            if node.script is not None and node.script.name in textnames:
+                xnode.set("blib_script", node.script.name)
+        elif node.mode == 'EXTERNAL':
+            spath = bpy.path.abspath(node.filepath)
+            if spath in scr_paths:
+                xnode.set("blib_filepath", scr_paths[spath])
+    elif node.type == 'FRAME':
+        if node.text is not None and node.text.name in textnames:
+            xnode.set("blib_text", node.text.name)
+    elif hasattr(node, "image_user"):
+        if node.image in images:
+            xnode.set("blib_image", node.image.name)
+            ximageuser = ET.SubElement(xnode, "image_user")
+            set_attributes(node.image_user, ximageuser, optimize_file)
+    elif hasattr(node, "mapping") and hasattr(node.mapping, "curves"):
+        counts = []
+        handles = []
+        locations = []
+        for curve in node.mapping.curves:
+            points = [0.0] * (len(curve.points) * 2)
+            curve.points.foreach_get("location", points)
+            locations.extend(points)
+            counts.append(str(len(curve.points)))
+            handles.extend(handle_codes[point.handle_type] for point in curve.points)
+        xcurvedata = ET.SubElement(xnode, "curve_data")
+        xcurvedata.set("encoding", "float32")
+        xcurvedata.set("counts", " ".join(counts))
+        xcurvedata.set("handles", "".join(handles))
+        xcurvedata.text = pack_floats(locations)
+    elif hasattr(node, "color_ramp"):
+        ramp = node.color_ramp
+        positions = [0.0] * len(ramp.elements)
+        colors = [0.0] * (len(ramp.elements) * 4)
+        ramp.elements.foreach_get("position", positions)
+        ramp.elements.foreach_get("color", colors)
+        xrampdata = ET.SubElement(xnode, "ramp_data")
+        set_attributes(ramp, xrampdata, optimize_file)
+        xrampdata.set("encoding", "float32")
+        xrampdata.text = pack_floats(positions + colors)
+    return xnode
+
+#Single character codes of the curve point handle types
+handle_codes = {
+    'AUTO': "a",
+    'AUTO_CLAMPED': "c",
+    'VECTOR': "v"
+}
+
+def pack_floats(values):
+    """
+    Encode a list of numbers as base64 of little-endian float32.
+    
+    Args:
+        values (list[float]): The numbers to be encoded.
+    
+    Returns:
+        str: The encoded numbers.
+    """
+    
+    data = array("f", values)
+    if sys.byteorder == "big":
+        data.byteswap()
+    return b64encode(data.tobytes()).decode("ascii")
+
+def gen_link(link, socket_map):
+    xlink = ET.Element("link")
+    xlink.set("from_node", link.from_node.name)
+    xlink.set("from_socket", str(socket_map[link.from_socket.as_pointer()]))
+    xlink.set("to_node", link.to_node.name)
+    xlink.set("to_socket", str(socket_map[link.to_socket.as_pointer()]))
+    return xlink
+
+def iter_tree(tree, images, scr_paths, textnames, optimize_file):
+    """
+    Serialize the nodes and links of a node tree one at a time, shared by 'gen_tree' and 'write_tree'.
+    
+    Yields:
+        (tag, xml.etree.ElementTree.Element): The tag of the element grouping the serialized item ("nodes" or "links"),
+            and the item itself, all nodes coming before all links.
+    """
+    
+    #Sockets are indexed by pointer while exporting the nodes, to be looked up by the links
+    socket_map = {}
+    
+    for node in tree.nodes:
+        yield "nodes", gen_node(node, images, scr_paths, textnames, optimize_file, socket_map)
+    
+    for link in tree.links:
+        yield "links", gen_link(link, socket_map)
+
+def gen_tree(tree, images, scr_paths, textnames, optimize_file):
+    """Serialize the nodes and links of a node tree as complete elements, as written by 'write_tree'."""
+    
+    xelements = []
+    for tag, xelement in iter_tree(tree, images, scr_paths, textnames, optimize_file):
+        if not xelements or xelements[-1].tag != tag:
+            xelements.append(ET.Element(tag))
+        xelements[-1].append(xelement)
+    return xelements
+
+def write_tree(writer, tree, images, scr_paths, textnames, optimize_file):
+    current = None
+    for tag, xelement in iter_tree(tree, images, scr_paths, textnames, optimize_file):
+        if tag != current:
+            if current is not None:
+                writer.end()
+            writer.start(tag)
+            current = tag
+        writer.add(xelement)
+    if current is not None:
+        writer.end()
+
+class XMLWriter(object):
+    """
+    Serialize the structure XML one element at a time, as it is generated.
+    
+    Elements with children are opened with 'start' and closed with 'end', and complete elements are added with 'add'.
+    If a stream is given, each element is written (and can then be discarded) as soon as it is complete,
+    so only the element being generated is kept in memory, otherwise the whole tree is built and serialized at the end.
+    Both ways produce the same output, including structure numbers and pretty printing.
+    
+    Args:
+        stream (file object or None): Binary file to which the XML is written.
+        pretty_print (bool): Format XML to improve readability.
+    """
+    
+    def __init__(self, stream=None, pretty_print=False):
+        self._stream = stream
+        self._pretty_print = pretty_print
+        self._structs = {}
+        self._stack = []
+        self._pending = None
+        self._root = None
+        
+        if stream is not None:
+            stream.write(self._header())
+    
+    def start(self, tag):
+        """
+        Open an element, to which children are then added until 'end' is called.
+        
+        Args:
+            tag (str): Tag of the element.
+        
+        Returns:
+            xml.etree.ElementTree.Element: The element, on which the attributes should be set before adding children.
+        """
+        
+        if self._stream is None:
+            if self._stack:
+                xelement = ET.SubElement(self._stack[-1], tag)
+            else:
+                xelement = ET.Element(tag)
+                self._root = xelement
+        else:
+            self._open_pending()
+            if self._stack:
+                self._separate(len(self._stack))
+            xelement = ET.Element(tag)
+            self._pending = xelement
+        self._stack.append(xelement)
+        return xelement
+    
+    def add(self, xelement):
+        """
+        Add a complete element to the currently open element.
+        
+        Args:
+            xelement (xml.etree.ElementTree.Element): The element to be added.
+        """
+        
+        if self._stream is None:
+            self._stack[-1].append(xelement)
+        else:
+            self._open_pending()
+            level = len(self._stack)
+            self._separate(level)
+            self._write(xelement, level)
+    
+    def end(self):
+        """Close the currently open element."""
+        
+        xelement = self._stack.pop()
+        if self._stream is not None:
+            level = len(self._stack)
+            if xelement is self._pending: #No children were added
+                self._pending = None
+                self._write(xelement, level)
+            else:
+                self._separate(level)
+                self._stream.write("</{}>".format(xelement.tag).encode("utf-8"))
+                if self._pretty_print and level == 0:
+                    self._stream.write(b"\n")
+    
+    def finish(self):
+        """
+        Finish the serialization.
+        
+        Returns:
+            bytes or None: The XML, or None if it was written to the stream.
+        """
+        
+        if self._stream is not None:
+            return None
+        
+        number_structs(self._root, self._structs)
+        if self._pretty_print:
+            indent(self._root)
+        return self._header() + ET.tostring(self._root, encoding="utf-8")
+    
+    def _header(self):
+        xml = b"<?xml version='1.0' encoding='utf-8'?>"
+        if self._pretty_print:
+            xml += b"\n"
+        return xml
+    
+    def _separate(self, level):
+        if self._pretty_print:
+            self._stream.write(("\n" + level * "\t").encode("utf-8"))
+    
+    def _open_pending(self):
+        if self._pending is not None:
+            number_structs(self._pending, self._structs)
+            #Serialize with some text, so that the start tag is not written as an empty element
+            self._pending.text = " "
+            data = ET.tostring(self._pending, encoding="utf-8")
+            self._pending.text = None
+            self._stream.write(data[:data.index(b">") + 1])
+            self._pending = None
+    
+    def _write(self, xelement, level):
+        number_structs(xelement, self._structs)
+        if self._pretty_print:
+            indent(xelement, level)
+            xelement.tail = None
+        self._stream.write(ET.tostring(xelement, encoding="utf-8"))
+
+def list_resources(tree, imgi_export=True, imge_export=True, seq_export=True, mov_export=True, txti_export=True, txte_export=True,
+            script_export=True, blib=False, txt_embed=False):
+    """
+    List the images and texts used by the nodes of a single node tree (not including nested groups).
+    
+    Args:
+        tree (bpy.types.NodeTree): The node tree.
+        Other arguments: The same as for 'generate_xml'.
+    
+    Returns:
+        (images, texts, textnames, scripts, failures)
+        images (dict): Dictionary mapping the images to be exported to their frame range (None for still images).
+        texts (dict): Dictionary mapping the texts to be exported to their origin ("internal" or "external").
+        textnames (list[str]): Names of the texts to be exported.
+        scripts (list[str]): Paths to the external scripts to be exported.
+        failures (list[tuple]): (type, action) pairs of the resources that can't be exported (see 'blib.utils.fail').
+    """
+    
+    img_export = True if imgi_export or imge_export or seq_export or mov_export else False
+    txt_export = True if txti_export or txte_export else False
+    
+    images = {}
+    scripts = []
+    texts = {}
+    textnames = []
+    failures = []
+    
+    for node in tree.nodes:
+        if node.type == 'SCRIPT':
+            if node.mode == 'INTERNAL':
+                if txt_export and node.script is not None:
+                    export = False
+                    if node.script.filepath == "" or not path.isfile(bpy.path.abspath(node.script.filepath)):
+                        if txti_export and (blib or txt_embed != False):
+                            export = True
+                            if node.script not in texts:
+                                texts[node.script] = "internal"
+                    else:
+                        if txte_export and (blib or txt_embed == True):
+                            export = True
+                            if node.script not in texts:
+                                texts[node.script] = "external"
+                    if export and node.script.name not in textnames:
+                        textnames.append(node.script.name)
+            elif node.mode == 'EXTERNAL':
+                if script_export and blib and node.filepath != "":
                     spath = bpy.path.abspath(node.filepath)
-                    if spath in scr_paths:
-                        xnode.set("blib_filepath", scr_paths[spath])
-            elif node.type == 'FRAME':
-                if node.text is not None and node.text.name in textnames:
-                    xnode.set("blib_text", node.text.name)
-            elif hasattr(node, "image_user"):
-                if node.image in images:
-                    xnode.set("blib_image", node.image.name)
-                    ximageuser = ET.SubElement(xnode, "image_user")
-                    set_attributes(node.image_user, ximageuser, optimize_file)
-            elif hasattr(node, "mapping") and hasattr(node.mapping, "curves"):
-                curvedata = [[[list(point.location), point.handle_type] for point in curve.points] for curve in node.mapping.curves]
-                xcurvedata = ET.SubElement(xnode, "curve_data")
-                xcurvedata.text = str(curvedata)
-            elif hasattr(node, "color_ramp"):
-                ramp = node.color_ramp
-                rampdata = [[element.position, list(element.color)] for element in ramp.elements]
-                xrampdata = ET.SubElement(xnode, "ramp_data")
-                set_attributes(ramp, xrampdata, optimize_file)
-                xrampdata.text = str(rampdata)
-    return
+                    if path.isfile(spath):
+                        if spath not in scripts:
+                            scripts.append(spath)
+                    else:
+                        failures.append(("scripts", "export script '{}', file is missing".format(spath)))
+        elif node.type == 'FRAME':
+            if txt_export and node.text is not None:
+                export = False
+                if node.text.filepath == "" or not path.isfile(bpy.path.abspath(node.text.filepath)):
+                    if txti_export and (blib or txt_embed != False):
+                        export = True
+                        if node.text not in texts:
+                            texts[node.text] = "internal"
+                else:
+                    if txte_export and (blib or txt_embed == True):
+                        export = True
+                        if node.text not in texts:
+                            texts[node.text] = "external"
+                if export and node.text.name not in textnames:
+                    textnames.append(node.text.name)
+        elif hasattr(node, "image_user"):
+            if img_export and blib and node.image is not None:
+                if node.image.source == 'SEQUENCE':
+                    if seq_export:
+                        if path.isfile(bpy.path.abspath(node.image.filepath)):
+                            frange = [node.image_user.frame_offset + 1, node.image_user.frame_offset + node.image_user.frame_duration]
+                            if node.image in images:
+                                if images[node.image][0] > frange[0]:
+                                    images[node.image][0] = frange[0]
+                                if images[node.image][1] < frange[1]:
+                                    images[node.image][1] = frange[1]
+                            else:
+                                images[node.image] = frange
+                        else:
+                            failures.append(("images", "export sequence '{}', file is missing".format(node.image.name)))
+                elif node.image.source == 'MOVIE':
+                    if mov_export:
+                        if path.isfile(bpy.path.abspath(node.image.filepath)):
+                            frange = (node.image_user.frame_offset + 1, node.image_user.frame_offset + node.image_user.frame_duration)
+                            if node.image in images:
+                                if images[node.image][0] > frange[0]:
+                                    images[node.image][0] = frange[0]
+                                if images[node.image][1] < frange[1]:
+                                    images[node.image][1] = frange[1]
+                            else:
+                                images[node.image] = frange
+                        else:
+                            failures.append(("images", "export movie '{}', file is missing".format(node.image.name)))
+                elif imgi_export and node.image.packed_file is not None:
+                    if node.image not in images:
+                        images[node.image] = None
+                elif imge_export:
+                    if path.isfile(bpy.path.abspath(node.image.filepath)):
+                        if node.image not in images:
+                            images[node.image] = None
+                    else:
+                        failures.append(("images", "export image '{}', file is missing".format(node.image.name)))
+    
+    return images, texts, textnames, scripts, failures
 
-def set_links(asset, xelement):
-    if len(asset.links) > 0:
-        xlinks = ET.SubElement(xelement, "links")
-        for link in asset.links:
-            f_index = list(link.from_node.outputs).index(link.from_socket)
-            t_index = list(link.to_node.inputs).index(link.to_socket)
-            xlink = ET.SubElement(xlinks, "link")
-            xlink.set("from_node", link.from_node.name)
-            xlink.set("from_socket", str(f_index))
-            xlink.set("to_node", link.to_node.name)
-            xlink.set("to_socket", str(t_index))
-    return
+def tree_key(tree, images, scr_paths, textnames):
+    """
+    Get the resource lookups made when serializing the nodes of a node tree (see 'gen_node'),
+    which, along with the export options, determine whether the serialized tree can be reused.
+    """
+    
+    lookups = []
+    for node in tree.nodes:
+        if node.type == 'SCRIPT':
+            if node.mode == 'INTERNAL':
+                lookups.append(node.script is not None and node.script.name in textnames)
+            elif node.mode == 'EXTERNAL':
+                lookups.append(scr_paths.get(bpy.path.abspath(node.filepath)))
+        elif node.type == 'FRAME':
+            lookups.append(node.text is not None and node.text.name in textnames)
+        elif hasattr(node, "image_user"):
+            lookups.append(node.image in images)
+    return tuple(lookups)
+
+class ExportSession(object):
+    """
+    Cache shared by the exports of a batch, so that node groups used by several assets are only processed once.
+    
+    For each node group, the resources it uses and its serialized nodes and links are cached,
+    along with the export options and resource lookups they depend on, so that they are only reused
+    by exports that would produce the same result. Structure numbers are assigned when each file is written,
+    so the cached elements are copied into every file using them.
+    
+    The node groups are assumed not to change during the session, so a session should only live
+    for a single run of the export operator, during which nothing else can edit them.
+    
+    Attributes:
+        hits (int): Number of node groups reused from the cache.
+        misses (int): Number of node groups that had to be serialized.
+    """
+    
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._resources = {}
+        self._trees = {}
+    
+    def resources(self, tree, options):
+        """
+        Get the resources used by a node tree (see 'list_resources').
+        
+        Args:
+            tree (bpy.types.NodeTree): The node tree.
+            options (tuple): Arguments of 'list_resources' following 'tree'.
+        
+        Returns:
+            tuple: The result of 'list_resources'.
+        """
+        
+        entry = self._resources.get(tree)
+        if entry is None or entry[0] != options:
+            entry = (options, list_resources(tree, *options))
+            self._resources[tree] = entry
+        return entry[1]
+    
+    def tree(self, tree, images, scr_paths, textnames, optimize_file):
+        """
+        Get the serialized nodes and links of a node tree (see 'gen_tree').
+        
+        Returns:
+            list[xml.etree.ElementTree.Element]: Copies of the cached elements, to be added to the structure XML.
+        """
+        
+        key = (optimize_file, tree_key(tree, images, scr_paths, textnames))
+        entry = self._trees.get(tree)
+        if entry is None or entry[0] != key:
+            self.misses += 1
+            entry = (key, gen_tree(tree, images, scr_paths, textnames, optimize_file))
+            self._trees[tree] = entry
+        else:
+            self.hits += 1
+        return [deepcopy(xelement) for xelement in entry[1]]
 
 def generate_xml(asset, imgi_export=True, imge_export=True, seq_export=True, mov_export=True, txti_export=True, txte_export=True,
-            script_export=True, optimize_file=False, blib=False, txt_embed=False, pretty_print=False):
+            script_export=True, optimize_file=False, blib=False, txt_embed=False, pretty_print=False, stream=None, session=None,
+            prefix=""):
     """
     Generate XML representing a Cycles material or node group as per the Blib standard.
     
@@ -169,10 +677,16 @@ def generate_xml(asset, imgi_export=True, imge_export=True, seq_export=True, mov
         pretty_print (bool): Format XML to improve readability (increases file size),
             should only be used if XML is going to be read by a Human,
             should not be used if XML is to be part of a full .blib file.
+        stream (file object or None): Binary file to which the XML is written while it is generated,
+            instead of being returned, so that the whole XML is never kept in memory.
+        session (blib.cycles.generate_xml.ExportSession or None): Cache shared by the exports of a batch,
+            from which the node groups already serialized in the batch are reused.
+        prefix (str): Prefix of the paths of the resources within the archive,
+            used to keep the resources of each asset of a bundle apart (e.g. "assets/0/").
     
     Returns:
         (xml, image_list, text_list)
-        xml (bytes): byte string containing the xml.
+        xml (bytes or None): byte string containing the xml, None if it was written to 'stream'.
         image_list (list[dict]): list containing the images to be exported, in format:
             list(dict{
                 "image" (bpy.types.Image): Image data block,
@@ -195,14 +709,11 @@ def generate_xml(asset, imgi_export=True, imge_export=True, seq_export=True, mov
     check_asset(asset, True)
     
     if isinstance(asset, bpy.types.Material):
-        groups = [asset.node_tree]
-        ngroups = []
+        groups, deps = group_graph(asset.node_tree)
+        ngroups = group_order(asset.node_tree, deps)[1:]
     elif isinstance(asset, bpy.types.ShaderNodeTree):
-        groups = [asset]
-        ngroups = [asset]
-    
-    img_export = True if imgi_export or imge_export or seq_export or mov_export else False
-    txt_export = True if txti_export or txte_export else False
+        groups, deps = group_graph(asset)
+        ngroups = group_order(asset, deps)
     
     images = {}
     scripts = []
@@ -210,102 +721,42 @@ def generate_xml(asset, imgi_export=True, imge_export=True, seq_export=True, mov
     textnames = []
     failed = {}
     
-    #List groups images and texts
-    index = 0
-    while len(groups) > index:
-        for node in groups[index].nodes:
-            if node.type == 'GROUP':
-                ntree = node.node_tree
-                if ntree is not None:
-                    groups.append(ntree)
-                    if ntree in ngroups:
-                        ngroups.remove(ntree)
-                    ngroups.append(ntree)
-            elif node.type == 'SCRIPT':
-                if node.mode == 'INTERNAL':
-                    if txt_export and node.script is not None:
-                        export = False
-                        if node.script.filepath == "" or not path.isfile(bpy.path.abspath(node.script.filepath)):
-                            if txti_export and (blib or txt_embed != False):
-                                export = True
-                                if node.script not in texts:
-                                    texts[node.script] = "internal"
-                        else:
-                            if txte_export and (blib or txt_embed == True):
-                                export = True
-                                if node.script not in texts:
-                                    texts[node.script] = "external"
-                        if export and node.script.name not in textnames:
-                            textnames.append(node.script.name)
-                elif node.mode == 'EXTERNAL':
-                    if script_export and blib and node.filepath != "":
-                        spath = bpy.path.abspath(node.filepath)
-                        if path.isfile(spath):
-                            if spath not in scripts:
-                                scripts.append(spath)
-                        else:
-                            fail(failed, "scripts", "export script '{}', file is missing".format(spath))
-            elif node.type == 'FRAME':
-                if txt_export and node.text is not None:
-                    export = False
-                    if node.text.filepath == "" or not path.isfile(bpy.path.abspath(node.text.filepath)):
-                        if txti_export and (blib or txt_embed != False):
-                            export = True
-                            if node.text not in texts:
-                                texts[node.text] = "internal"
-                    else:
-                        if txte_export and (blib or txt_embed == True):
-                            export = True
-                            if node.text not in texts:
-                                texts[node.text] = "external"
-                    if export and node.text.name not in textnames:
-                        textnames.append(node.text.name)
-            elif hasattr(node, "image_user"):
-                if img_export and blib and node.image is not None:
-                    if node.image.source == 'SEQUENCE':
-                        if seq_export:
-                            if path.isfile(bpy.path.abspath(node.image.filepath)):
-                                frange = [node.image_user.frame_offset + 1, node.image_user.frame_offset + node.image_user.frame_duration]
-                                if node.image in images:
-                                    if images[node.image][0] > frange[0]:
-                                        images[node.image][0] = frange[0]
-                                    if images[node.image][1] < frange[1]:
-                                        images[node.image][1] = frange[1]
-                                else:
-                                    images[node.image] = frange
-                            else:
-                                fail(failed, "images", "export sequence '{}', file is missing".format(node.image.name))
-                    elif node.image.source == 'MOVIE':
-                        if mov_export:
-                            if path.isfile(bpy.path.abspath(node.image.filepath)):
-                                frange = (node.image_user.frame_offset + 1, node.image_user.frame_offset + node.image_user.frame_duration)
-                                if node.image in images:
-                                    if images[node.image][0] > frange[0]:
-                                        images[node.image][0] = frange[0]
-                                    if images[node.image][1] < frange[1]:
-                                        images[node.image][1] = frange[1]
-                                else:
-                                    images[node.image] = frange
-                            else:
-                                fail(failed, "images", "export movie '{}', file is missing".format(node.image.name))
-                    elif imgi_export and node.image.packed_file is not None:
-                        if node.image not in images:
-                            images[node.image] = None
-                    elif imge_export:
-                        if path.isfile(bpy.path.abspath(node.image.filepath)):
-                            if node.image not in images:
-                                images[node.image] = None
-                        else:
-                            fail(failed, "images", "export image '{}', file is missing".format(node.image.name))
-        index += 1
+    options = (imgi_export, imge_export, seq_export, mov_export, txti_export, txte_export, script_export, blib, txt_embed)
+    
+    #List images and texts, visiting each group once
+    for grp in groups:
+        if session is None:
+            grp_images, grp_texts, grp_textnames, grp_scripts, failures = list_resources(grp, *options)
+        else:
+            grp_images, grp_texts, grp_textnames, grp_scripts, failures = session.resources(grp, options)
+        
+        for img, frange in grp_images.items():
+            if img not in images:
+                images[img] = None if frange is None else frange[:]
+            elif frange is not None:
+                if images[img][0] > frange[0]:
+                    images[img][0] = frange[0]
+                if images[img][1] < frange[1]:
+                    images[img][1] = frange[1]
+        for txt, origin in grp_texts.items():
+            if txt not in texts:
+                texts[txt] = origin
+        for name in grp_textnames:
+            if name not in textnames:
+                textnames.append(name)
+        for spath in grp_scripts:
+            if spath not in scripts:
+                scripts.append(spath)
+        for f_type, action in failures:
+            fail(failed, f_type, action)
     
     #Copy text names and generate dictionary
     if txt_embed == True:
         txt_rel_paths = []
     elif txt_embed == False:
-        txt_rel_paths = {txt: {"src": bpy.path.abspath(txt.filepath), "dst": "texts/" + txt.name} for txt in texts}
+        txt_rel_paths = {txt: {"src": bpy.path.abspath(txt.filepath), "dst": prefix + "texts/" + txt.name} for txt in texts}
     elif txt_embed is None:
-        txt_rel_paths = {txt: {"src": bpy.path.abspath(txt.filepath), "dst": "texts/" + txt.name} for txt in texts if texts[txt] == "external"}
+        txt_rel_paths = {txt: {"src": bpy.path.abspath(txt.filepath), "dst": prefix + "texts/" + txt.name} for txt in texts if texts[txt] == "external"}
     
     #Uniquify script names and generate dictionary
     scripts.sort(key=lambda x: bpy.path.basename(x).lower())
@@ -334,22 +785,23 @@ def generate_xml(asset, imgi_export=True, imge_export=True, seq_export=True, mov
                         break
                 else:
                     ok = True
-                    tpath = "texts/" + name
+                    tpath = prefix + "texts/" + name
                     txt_rel_paths_export[scr] = tpath#, "name": name
                     scr_rel_paths[scr] = tpath
     
-    xroot = ET.Element("blib")
+    writer = XMLWriter(stream, pretty_print)
+    xroot = writer.start("blib")
     xroot.set("type", "cycles")
     xroot.set("version", str(version))
     xroot.set("compatible", str(compatible))
     
     #Export resources
     if len(ngroups) > 0 or len(images) > 0 or len(texts) > 0:
-        xres = ET.SubElement(xroot, "resources")
+        writer.start("resources")
         
         #Images
         if len(images) > 0:
-            ximgs = ET.SubElement(xres, "images")
+            ximgs = ET.Element("images")
             seqindex = 1
             for img in images:
                 ximg = ET.SubElement(ximgs, "image")
@@ -357,52 +809,67 @@ def generate_xml(asset, imgi_export=True, imge_export=True, seq_export=True, mov
                 ximg.set("source", img.source)
                 
                 if img.source == 'SEQUENCE':
-                    ximg.set("path", "images/sequence_" + str(seqindex) + "/" + bpy.path.basename(img.filepath))
+                    ximg.set("path", prefix + "images/sequence_" + str(seqindex) + "/" + bpy.path.basename(img.filepath))
                     seqindex += 1
                 else:
-                    ximg.set("path", "images/" + img.name)
+                    ximg.set("path", prefix + "images/" + img.name)
                     if img.source in {'FILE', 'GENERATED'}:
                         if img.packed_file is None:
                             ximg.set("origin", "external")
                         else:
                             ximg.set("origin", "internal")
+            writer.add(ximgs)
         
         #Texts
         if len(texts) > 0:
-            xtxts = ET.SubElement(xres, "texts")
+            writer.start("texts")
             for txt, val in texts.items():
-                xtxt = ET.SubElement(xtxts, "text")
+                xtxt = ET.Element("text")
                 xtxt.set("name", txt.name)
                 xtxt.set("origin", val)
                 if txt in txt_rel_paths:
                     xtxt.set("path", txt_rel_paths[txt]["dst"])
                 else:
                     xtxt.text = txt.as_string()
+                writer.add(xtxt)
+            writer.end()
         
         #Groups
         if len(ngroups) > 0:
-            xgrps = ET.SubElement(xres, "groups")
+            writer.start("groups")
             for grp in reversed(ngroups):
-                xgrp = ET.SubElement(xgrps, "group")
+                xgrp = writer.start("group")
                 xgrp.set("bl_idname", grp.bl_idname)
                 xgrp.set("name", grp.name)
-                set_nodes(grp, xgrp, images, script_export, scr_rel_paths, textnames, optimize_file)
-                set_links(grp, xgrp)
+                if session is None:
+                    write_tree(writer, grp, images, scr_rel_paths, textnames, optimize_file)
+                else:
+                    for xelement in session.tree(grp, images, scr_rel_paths, textnames, optimize_file):
+                        writer.add(xelement)
+                writer.end()
+            writer.end()
+        
+        writer.end()
     
     #Export material
     if isinstance(asset, bpy.types.Material):
-        xmat = ET.SubElement(xroot, "main")
+        xmat = writer.start("main")
         xmat.set("name", asset.name)
-        xmat.set("diffuse_color", str(list(asset.diffuse_color)))
-        xmat.set("specular_color", str(list(asset.specular_color)))
-        xmat.set("alpha", str(asset.alpha))
-        xmat.set("specular_hardness", str(asset.specular_hardness))
-        xmat.set("pass_index", str(asset.pass_index))
+        types = []
+        set_value(xmat, "diffuse_color", list(asset.diffuse_color), types)
+        set_value(xmat, "specular_color", list(asset.specular_color), types)
+        set_value(xmat, "alpha", asset.alpha, types)
+        set_value(xmat, "specular_hardness", asset.specular_hardness, types)
+        set_value(xmat, "pass_index", asset.pass_index, types)
+        xmat.set("blib_types", " ".join(types))
         
-        xcycles = ET.SubElement(xmat, "cycles_settings")
+        xcycles = ET.Element("cycles_settings")
         set_attributes(asset.cycles, xcycles, optimize_file)
-        set_nodes(asset.node_tree, xmat, images, script_export, scr_rel_paths, textnames, optimize_file)
-        set_links(asset.node_tree, xmat)
+        writer.add(xcycles)
+        write_tree(writer, asset.node_tree, images, scr_rel_paths, textnames, optimize_file)
+        writer.end()
+    
+    writer.end()
     
     #Generate image list
     imagelist = []
@@ -411,16 +878,16 @@ def generate_xml(asset, imgi_export=True, imge_export=True, seq_export=True, mov
         if img.source == 'SEQUENCE':
             imagelist.append({
             "image": img,
-            "destination": "images/sequence_" + str(seqindex),
+            "destination": prefix + "images/sequence_" + str(seqindex),
             "range": frange})
             seqindex += 1
         elif img.source == 'MOVIE':
             imagelist.append({
             "image": img,
-            "destination": "images/" + img.name,
+            "destination": prefix + "images/" + img.name,
             "range": frange})
         else:
-            imagelist.append({"image": img, "destination": "images/" + img.name})
+            imagelist.append({"image": img, "destination": prefix + "images/" + img.name})
     
     #Generate text list
     textlist = []
@@ -430,15 +897,7 @@ def generate_xml(asset, imgi_export=True, imge_export=True, seq_export=True, mov
         else:
             textlist.append({"text": txt, "source": val["src"], "destination": val["dst"]})
     
-    #Pretty print
-    if pretty_print:
-        indent(xroot)
-    
-    #tree = ET.ElementTree(xroot)
-    xml = b"<?xml version='1.0' encoding='utf-8'?>"
-    if pretty_print:
-        xml += b"\n"
-    xml += ET.tostring(xroot, encoding="utf-8")
+    xml = writer.finish()
     
     for f in failed:
         print("{} {} failed to be exported.".format(failed[f], f))
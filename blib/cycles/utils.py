@@ -23,10 +23,10 @@
 
 import bpy
 
-import xml.etree.cElementTree as ET
 import zipfile as zf
+import xml.etree.cElementTree as ET
 from ..exceptions import InvalidObject
-from ..utils import get_file_type
+from ..utils import get_file_type, BlibFile
 
 def check_asset(asset, do_raise=False):
     """
@@ -70,25 +70,81 @@ def check_asset(asset, do_raise=False):
             else:
                 return False
         
-        groups = [tree]
-        while groups:
-            for node in groups.pop(0).nodes:
+        for grp in group_graph(tree)[0]:
+            for node in grp.nodes:
                 if 'NEW_SHADING' not in node.shading_compatibility:
                     if do_raise:
                         raise InvalidObject("Node tree contains non Cycles nodes.")
                     else:
                         return False
-                
-                if node.bl_static_type == 'GROUP':
-                    groups.append(node.node_tree)
     return True
 
+def group_graph(tree):
+    """
+    Build the dependency graph of the node groups used by a node tree, visiting each group only once.
+    
+    Args:
+        tree (bpy.types.NodeTree): The node tree from which to start.
+    
+    Returns:
+        (groups, deps)
+        groups (list[bpy.types.NodeTree]): 'tree' followed by all node groups it uses (directly or nested),
+            each listed once, in breadth-first order of their first use.
+        deps (dict): Dictionary mapping each node tree in 'groups' to the list of node groups used by its group nodes,
+            in node order, including repeats.
+    """
+    
+    groups = [tree]
+    seen = {tree}
+    deps = {}
+    index = 0
+    while len(groups) > index:
+        grp = groups[index]
+        deps[grp] = [node.node_tree for node in grp.nodes if node.type == 'GROUP' and node.node_tree is not None]
+        for dep in deps[grp]:
+            if dep not in seen:
+                seen.add(dep)
+                groups.append(dep)
+        index += 1
+    return groups, deps
+
+def group_order(tree, deps):
+    """
+    Order node groups by their last use in a breadth-first traversal that visits groups again each time they are used,
+    so that every group comes after all groups using it, without actually repeating the traversal for each use.
+    
+    The last use of a group is at the deepest level it is used at, after the uses at that level of all groups
+    whose path of group nodes from 'tree' is lexicographically smaller, which is resolved level by level.
+    
+    Args:
+        tree (bpy.types.NodeTree): The node tree from which the traversal starts.
+        deps (dict): Dependency graph of 'tree' (see 'group_graph').
+    
+    Returns:
+        list[bpy.types.NodeTree]: 'tree' followed by all node groups it uses, in order of their last use.
+    """
+    
+    level = {tree: 0}
+    last = {tree: (0, 0)}
+    depth = 0
+    while level and depth < len(deps):
+        keys = {}
+        for grp, rank in level.items():
+            for i, dep in enumerate(deps[grp]):
+                if dep not in keys or keys[dep] < (rank, i):
+                    keys[dep] = (rank, i)
+        depth += 1
+        level = {grp: rank for rank, grp in enumerate(sorted(keys, key=keys.get))}
+        for grp, rank in level.items():
+            last[grp] = (depth, rank)
+    return sorted(last, key=last.get)
+
 def get_sub_type(f_path):
     """
     Get the subtype of a 'cycles' type Blib file.
     
     Args:
-        f_path (str): Path to the file to be checked.
+        f_path (str or blib.utils.BlibFile): Path to the file to be checked, or the already open file.
     
     Returns:
         str or None
@@ -96,36 +152,90 @@ def get_sub_type(f_path):
         if no valid sub-type is found, None is returned.
     """
     
-    try:
-        archive = zf.ZipFile(f_path, 'r')
-    except zf.BadZipFile:
-        return None
+    if not isinstance(f_path, BlibFile):
+        with BlibFile(f_path) as blib_file:
+            return get_sub_type(blib_file)
+    
+    #Files exported since version 0.1.6 store the sub-type in the meta-data
+    if f_path.type == "cycles" and f_path.sub_type is not None:
+        return f_path.sub_type
     
     try:
-        xml_file = archive.open("structure.xml", 'r')
-    except KeyError:
+        xml_file = f_path.archive.open("structure.xml", 'r')
+    except (AttributeError, KeyError):
         return None
     
-    tree = ET.ElementTree(file=xml_file)
+    sub_type = sniff_sub_type(xml_file)
     xml_file.close()
-    xroot = tree.getroot()
-    if xroot.tag != "blib":
-        return None
-    if xroot.attrib["type"] != "cycles":
+    return sub_type
+
+def sniff_sub_type(xml_file):
+    """
+    Get the subtype from a 'cycles' structure XML, parsing only as far as needed.
+    
+    Args:
+        xml_file (file object): The structure XML file.
+    
+    Returns:
+        str or None
+        A string containing the Blib sub-type is returned,
+        if no valid sub-type is found, None is returned.
+    """
+    
+    depth = 0
+    resources = False
+    for event, elem in ET.iterparse(xml_file, events=("start", "end")):
+        if event == "start":
+            if depth == 0:
+                if elem.tag != "blib" or elem.attrib.get("type") != "cycles":
+                    return None
+            elif depth == 1:
+                if elem.tag == "main":
+                    return "mat"
+                if elem.tag == "resources":
+                    resources = True
+            depth += 1
+        else:
+            depth -= 1
+            elem.clear()
+    return "grp" if resources else None
+
+def read_index(f_path):
+    """
+    Read the list of assets in a 'cycles' type Blib bundle.
+    
+    Args:
+        f_path (str or blib.utils.BlibFile): Path to the file to be read, or the already open file.
+    
+    Returns:
+        list[dict] or None
+        The assets in the bundle, in format:
+            list(dict{
+                "name" (str): Name of the asset,
+                "sub_type" (str): Blib sub-type of the asset,
+                "path" (str): Path to the structure XML of the asset within the archive,
+                })
+        None is returned if the file is not a bundle, or if its index is missing or broken.
+        The index is only read once per open file (see 'blib.utils.BlibFile.index'),
+        and the same list is returned every time, so it should not be modified.
+    """
+    
+    if not isinstance(f_path, BlibFile):
+        with BlibFile(f_path) as blib_file:
+            return read_index(blib_file)
+    
+    if f_path.type != "cycles" or f_path.sub_type != "bundle":
         return None
-    if xroot.find("main") is not None:
-        return "mat"
-    if xroot.find("resources") is not None:
-        return "grp"
-    return None
+    
+    return f_path.index
 
 def check_file(f_path, sub=None):
     """
     Check if file is a 'cycles' type blib file.
-    Optionally check if file is of a specific subtype.
+    Optionally check if file is of a specific subtype, or is a bundle containing assets of that subtype.
     
     Args:
-        f_path (str): Path to the file to be checked.
+        f_path (str or blib.utils.BlibFile): Path to the file to be checked, or the already open file.
         sub (str or None): If a str is provided, it should be the subtype to check against,
             if None is given, no subtype check is performed.
     
@@ -133,9 +243,17 @@ def check_file(f_path, sub=None):
         bool: True if the file is of type 'cycles', and if it matches the optional subtype.
     """
     
+    if not isinstance(f_path, BlibFile):
+        with BlibFile(f_path) as blib_file:
+            return check_file(blib_file, sub)
+    
     if get_file_type(f_path) == "cycles":
         if sub is not None:
-            return get_sub_type(f_path) == sub
+            sub_type = get_sub_type(f_path)
+            if sub_type == "bundle":
+                assets = read_index(f_path)
+                return assets is not None and any(asset["sub_type"] == sub for asset in assets)
+            return sub_type == sub
         else:
             return True
     else:
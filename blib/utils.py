@@ -22,11 +22,33 @@
 """Utility classes and functions for Blib packages."""
 
 import zipfile as zf
+import zlib
+import sqlite3
+import json
+import struct
+import mmap
+import xml.etree.cElementTree as ET
 from binascii import crc32
-from hashlib import sha1
-from os import path, makedirs, listdir
+from hashlib import sha1, sha256
+from os import path, makedirs, mkdir, rmdir, listdir, remove, stat, cpu_count
 from shutil import copyfileobj
-from io import BytesIO
+from tempfile import mkdtemp
+from time import localtime, perf_counter, time, sleep
+from collections import deque, OrderedDict
+from weakref import WeakKeyDictionary
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+#Kernel-side file copies, only available on some platforms
+try:
+    from os import copy_file_range
+except ImportError:
+    copy_file_range = None
+
+try:
+    from os import sendfile
+except ImportError:
+    sendfile = None
 
 class Version(object):
     """
@@ -128,6 +150,9 @@ class ResourceDir(object):
     """
     Keeps initialized path available, but only creates directory when the path is requested.
     
+    The directory is a new numbered sub-directory of the resource type directory ('tmp' gets a uniquely
+    named one instead), allocated atomically, so that several processes can share the same resources.
+    
     Using str(instance) will create the directory (if necessary), and return the path.
     
     When truth checking an instance, it will be True only if the path has been requested
@@ -177,22 +202,1067 @@ class ResourceDir(object):
     
     def _make(self):
         if self._path is None:
+            if not path.isdir(self._root):
+                makedirs(self._root, exist_ok=True)
             if self._name == "tmp":
-                self._path = self._root
+                #Each instance gets its own directory, so that concurrent imports don't remove each other's files
+                self._path = mkdtemp(dir=self._root)
             else:
-                if path.isdir(self._root):
-                    dir_list = [int(d) for d in listdir(self._root) if path.isdir(path.join(self._root, d)) and is_int(d)]
-                    dir_list.sort()
-                    dir_name = str(dir_list[-1] + 1)
-                    self._path = path.join(self._root, dir_name)
-                else:
-                    self._path = path.join(self._root, "1")
-            if not path.isdir(self._path):
-                makedirs(self._path)
+                dir_list = [int(d) for d in listdir(self._root) if is_int(d)]
+                num = max(dir_list) + 1 if dir_list else 1
+                #Creating the directory fails if another process already took the number, so try the next one
+                while True:
+                    try:
+                        mkdir(path.join(self._root, str(num)))
+                    except FileExistsError:
+                        num += 1
+                    else:
+                        break
+                self._path = path.join(self._root, str(num))
+
+class DirLock(object):
+    """
+    Lock shared by several processes, held while a directory exists.
+    
+    Creating a directory is atomic, also on network file systems (NFS, SMB) where file locking is unreliable.
+    A lock older than 'stale' seconds is assumed to be left by a process that crashed, and is taken over.
+    
+    Used as a context manager, holding the lock inside the 'with' block.
+    
+    Args:
+        f_path (str): Path of the lock directory.
+        timeout (float): Seconds to wait for the lock, before raising 'TimeoutError'.
+        stale (float): Age in seconds after which a lock is taken over.
+    """
+    
+    def __init__(self, f_path, timeout=60.0, stale=600.0):
+        self._path = f_path
+        self._timeout = timeout
+        self._stale = stale
+    
+    def __enter__(self):
+        start = time()
+        while True:
+            try:
+                mkdir(self._path)
+            except FileExistsError:
+                pass
+            else:
+                return self
+            
+            try:
+                if time() - stat(self._path).st_mtime > self._stale:
+                    rmdir(self._path)
+                    continue
+            except OSError:
+                #Released or taken over by another process in the meantime
+                continue
+            
+            if time() - start > self._timeout:
+                raise TimeoutError("Timed out waiting for lock '{}'".format(self._path))
+            sleep(0.05)
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        rmdir(self._path)
+
+class ResourceStore(object):
+    """
+    Persistent index of the files in a resource directory, for finding files identical to archive members.
+    
+    Files are indexed by size, crc32 and sha256, in an SQLite database in the resource directory,
+    so lookups and inserts only touch the matching entries instead of the whole index.
+    The sha256 hash of a file is only computed when it is first needed, and is computed again
+    if the file was modified since. Entries whose file no longer exists are removed when found.
+    
+    A 'list.sfv' file left by older versions is migrated into the database when it changes,
+    skipping the files it lists that no longer exist.
+    
+    Added files are only saved by 'commit', so an interrupted import never leaves entries
+    pointing to files that were not completely extracted.
+    
+    The index can be shared by several processes (e.g. render farm nodes importing to the same resources),
+    every change is written in its own short transaction, merging with the changes made by other processes,
+    and waiting up to 'timeout' seconds for them to finish writing. As SQLite's own locking is unreliable
+    on network file systems, writes are also serialized by a 'DirLock' next to the database.
+    
+    Args:
+        root (str): Path to the resource directory.
+        timeout (float): Seconds to wait for other processes writing to the index.
+    
+    Attributes:
+        root (read-only[str]): Path to the resource directory.
+    """
+    
+    def __init__(self, root, timeout=60.0):
+        self._root = root
+        self._pending = {}
+        if not path.isdir(root):
+            makedirs(root, exist_ok=True)
+        self._lock = DirLock(path.join(root, "resources.db.lock"), timeout)
+        with self._lock:
+            self._conn = sqlite3.connect(path.join(root, "resources.db"), timeout=timeout, isolation_level=None)
+            try:
+                self._conn.execute("CREATE TABLE IF NOT EXISTS resources "
+                                   "(path TEXT PRIMARY KEY, size INTEGER, crc INTEGER, mtime INTEGER, sha256 BLOB)")
+                self._conn.execute("CREATE INDEX IF NOT EXISTS resources_crc ON resources (crc)")
+                self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+                self._migrate()
+            except:
+                self._conn.close()
+                raise
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        self.close()
+    
+    @property
+    def root(self):
+        return self._root
+    
+    def find(self, archive, name):
+        """
+        Find a file in the resource directory, identical to an archive member.
+        
+        Args:
+            archive (zipfile.ZipFile): The archive containing the member.
+            name (str): The path of the member inside the archive (references are not resolved).
+        
+        Returns:
+            str or None: Path to the identical file, or None if there is none.
+        """
+        
+        zinfo = archive.getinfo(name)
+        rows = self._conn.execute("SELECT path, size, mtime, sha256 FROM resources WHERE crc = ? AND (size = ? OR size IS NULL)",
+                                  (zinfo.CRC, zinfo.file_size)).fetchall()
+        rows = [row for row in rows if row[0] not in self._pending]
+        rows.extend((rel_path, entry[0], entry[2], entry[3]) for rel_path, entry in self._pending.items()
+                    if entry[1] == zinfo.CRC and entry[0] == zinfo.file_size)
+        digest = None
+        for rel_path, size, mtime, file_digest in rows:
+            f_path = path.join(self._root, rel_path)
+            
+            #File is new to the index (migrated), or was modified since it was hashed
+            try:
+                f_stat = stat(f_path)
+                if f_stat.st_size != size or f_stat.st_mtime_ns != mtime or file_digest is None:
+                    f = open(f_path, 'rb')
+                    crc, file_digest = self._hash(f)
+                    f.close()
+                    self._update(rel_path, (f_stat.st_size, crc, f_stat.st_mtime_ns, file_digest))
+                    if f_stat.st_size != zinfo.file_size or crc != zinfo.CRC:
+                        continue
+            except OSError:
+                self._update(rel_path, None)
+                continue
+            
+            if digest is None:
+                member = archive.open(name, 'r')
+                digest = self._hash(member)[1]
+                member.close()
+            
+            if file_digest == digest:
+                return f_path
+        return None
+    
+    def add(self, f_path, crc):
+        """
+        Add a file to the index, when 'commit' is called.
+        
+        Args:
+            f_path (str): Path to the file, inside the resource directory.
+            crc (int): crc32 hash of the file.
+        """
+        
+        f_stat = stat(f_path)
+        self._pending[path.relpath(f_path, self._root)] = [f_stat.st_size, crc, f_stat.st_mtime_ns, None]
+    
+    def commit(self):
+        """Save all files added to the index."""
+        
+        if self._pending:
+            with self._lock:
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    self._conn.executemany("INSERT OR REPLACE INTO resources VALUES (?, ?, ?, ?, ?)",
+                                           [[rel_path] + entry for rel_path, entry in self._pending.items()])
+                except:
+                    self._conn.execute("ROLLBACK")
+                    raise
+                self._conn.execute("COMMIT")
+            self._pending.clear()
+    
+    def close(self):
+        """Close the index, discarding files added since the last commit."""
+        
+        self._pending.clear()
+        self._conn.close()
+    
+    def _update(self, rel_path, entry):
+        if rel_path in self._pending:
+            if entry is None:
+                del self._pending[rel_path]
+            else:
+                self._pending[rel_path] = list(entry)
+        elif entry is None:
+            with self._lock:
+                self._conn.execute("DELETE FROM resources WHERE path = ?", (rel_path,))
+        else:
+            with self._lock:
+                self._conn.execute("UPDATE resources SET size = ?, crc = ?, mtime = ?, sha256 = ? WHERE path = ?", entry + (rel_path,))
+    
+    def _hash(self, f):
+        crc = crc32(b"")
+        digest = sha256()
+        while True:
+            data = f.read(1 << 16)
+            if data:
+                crc = crc32(data, crc)
+                digest.update(data)
+            else:
+                break
+        return crc, digest.digest()
+    
+    def _migrate(self):
+        sfv_path = path.join(self._root, "list.sfv")
+        if not path.isfile(sfv_path):
+            return
+        
+        sfv_mtime = stat(sfv_path).st_mtime_ns
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'sfv_mtime'").fetchone()
+        if row is not None and row[0] == sfv_mtime:
+            return
+        
+        #Check again once holding the write lock, another process might have just migrated the same file
+        #(called by '__init__', while holding the directory lock)
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'sfv_mtime'").fetchone()
+            if row is None or row[0] != sfv_mtime:
+                hash_file = open(sfv_path, 'r', encoding="utf-8")
+                for line in hash_file:
+                    parts = line.strip().rsplit(" ", 1)
+                    if len(parts) == 2:
+                        try:
+                            crc = int(parts[1], 16)
+                        except ValueError:
+                            continue
+                        
+                        #Files removed since they were listed would otherwise stay in the index, until a lookup happens to match them
+                        if not path.isfile(path.join(self._root, parts[0])):
+                            continue
+                        self._conn.execute("INSERT OR IGNORE INTO resources VALUES (?, NULL, ?, NULL, NULL)", (parts[0], crc))
+                hash_file.close()
+                self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('sfv_mtime', ?)", (sfv_mtime,))
+        except:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+class ExportCache(object):
+    """
+    Persistent record of the files exported to a directory, for skipping the assets that did not change since.
+    
+    For every exported file, the sha1 hash of its structure XML, the crc32 hashes of its resources
+    and the options it was exported with are stored in an SQLite database in the export directory,
+    along with the size and modification time of the file, so that files modified or removed
+    since they were exported are always written again.
+    
+    Args:
+        root (str): Path to the export directory.
+        timeout (float): Seconds to wait for other processes writing to the cache.
+    
+    Attributes:
+        root (read-only[str]): Path to the export directory.
+        counts (read-only[dict]): Number of files "skipped", "updated" and "rebuilt" since the cache was opened.
+    """
+    
+    def __init__(self, root, timeout=60.0):
+        self._root = root
+        self._counts = {"skipped": 0, "updated": 0, "rebuilt": 0}
+        if not path.isdir(root):
+            makedirs(root, exist_ok=True)
+        self._conn = sqlite3.connect(path.join(root, ".blib_cache.db"), timeout=timeout, isolation_level=None)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS exports "
+                           "(path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, options TEXT, xml TEXT, resources TEXT)")
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    @property
+    def root(self):
+        return self._root
+    
+    @property
+    def counts(self):
+        return self._counts
+    
+    def check(self, f_path, options, xml, resources):
+        """
+        Find what has to be written to export a file again.
+        
+        Args:
+            f_path (str): Path to the file, inside the export directory.
+            options (str): Export options that change the file, other than its contents (e.g. compression).
+            xml (str): sha1 hash of the structure XML, in hexadecimal form.
+            resources (dict): Dictionary mapping the paths of the resources within the archive to their crc32 hash.
+        
+        Returns:
+            str: "skipped" if the file is up to date, "updated" if only the structure XML changed,
+            and "rebuilt" if the whole file has to be written.
+        """
+        
+        row = self._conn.execute("SELECT size, mtime, options, xml, resources FROM exports WHERE path = ?",
+                                 (path.relpath(f_path, self._root),)).fetchone()
+        if row is None:
+            return "rebuilt"
+        
+        try:
+            f_stat = stat(f_path)
+        except OSError:
+            return "rebuilt"
+        
+        if f_stat.st_size != row[0] or f_stat.st_mtime_ns != row[1] or options != row[2] or json.loads(row[4]) != resources:
+            return "rebuilt"
+        return "skipped" if xml == row[3] else "updated"
+    
+    def options(self, f_path):
+        """
+        Get the options a file was last exported with.
+        
+        Args:
+            f_path (str): Path to the file, inside the export directory.
+        
+        Returns:
+            str or None: The options, as passed to 'add', or None if the file is not in the cache.
+        """
+        
+        row = self._conn.execute("SELECT options FROM exports WHERE path = ?", (path.relpath(f_path, self._root),)).fetchone()
+        return row[0] if row is not None else None
+    
+    def add(self, f_path, action, options, xml, resources):
+        """
+        Record an exported file, once it is completely written.
+        
+        Args:
+            f_path (str): Path to the file, inside the export directory.
+            action (str): What was written, as returned by 'check'.
+            options, xml, resources: The same as passed to 'check'.
+        """
+        
+        f_stat = stat(f_path)
+        self._conn.execute("INSERT OR REPLACE INTO exports VALUES (?, ?, ?, ?, ?, ?)",
+                           (path.relpath(f_path, self._root), f_stat.st_size, f_stat.st_mtime_ns,
+                            options, xml, json.dumps(resources, sort_keys=True)))
+        self._counts[action] += 1
+    
+    def report(self):
+        """
+        Generate a human readable report of the exported files.
+        
+        Returns:
+            list[str]: One line per action.
+        """
+        
+        return ["{}: {} files".format(action.capitalize(), count) for action, count in self._counts.items()]
+    
+    def close(self):
+        """Close the cache."""
+        
+        self._conn.close()
+
+class HashCache(object):
+    """
+    Cache of the hashes of source files, so that files used by several exported assets are only read once per session.
+    
+    Entries are keyed by the path, size and modification time of the files, so modified files are hashed again,
+    and the least recently used entries are dropped when more than 'max_entries' files are cached.
+    The cache can be kept across sessions with 'load' and 'save'.
+    
+    Args:
+        max_entries (int): Maximum number of files in the cache.
+    
+    Attributes:
+        hits (int): Number of lookups answered from the cache.
+        misses (int): Number of lookups for which the file had to be read.
+    """
+    
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def get(self, f_path):
+        """
+        Get the hashes of a file, reading it only if it is not in the cache, or was modified since.
+        
+        Args:
+            f_path (str): Path to the file.
+        
+        Returns:
+            (crc, size, digest)
+            crc (int): crc32 hash of the file.
+            size (int): Size of the file in bytes.
+            digest (bytes): sha256 hash of the file.
+        """
+        
+        f_path = path.abspath(f_path)
+        f_stat = stat(f_path)
+        with self._lock:
+            entry = self._entries.get(f_path)
+            if entry is not None and entry[0] == f_stat.st_size and entry[1] == f_stat.st_mtime_ns:
+                self._entries.move_to_end(f_path)
+                self.hits += 1
+                return entry[2], entry[0], entry[3]
+            self.misses += 1
+        
+        f = open(f_path, 'rb')
+        crc = crc32(b"")
+        digest = sha256()
+        while True:
+            data = f.read(1 << 16)
+            if data:
+                crc = crc32(data, crc)
+                digest.update(data)
+            else:
+                break
+        f.close()
+        
+        self._add(f_path, (f_stat.st_size, f_stat.st_mtime_ns, crc, digest.digest()))
+        return crc, f_stat.st_size, digest.digest()
+    
+    def peek(self, f_path):
+        """
+        Get the hashes of a file only if they are in the cache, and the file was not modified since (see 'get').
+        
+        Args:
+            f_path (str): Path to the file.
+        
+        Returns:
+            (crc, size, digest) or None
+            The hashes of the file, or None if it has to be read, in which case the lookup is counted as a miss.
+        """
+        
+        f_path = path.abspath(f_path)
+        f_stat = stat(f_path)
+        with self._lock:
+            entry = self._entries.get(f_path)
+            if entry is not None and entry[0] == f_stat.st_size and entry[1] == f_stat.st_mtime_ns:
+                self._entries.move_to_end(f_path)
+                self.hits += 1
+                return entry[2], entry[0], entry[3]
+            self.misses += 1
+        return None
+    
+    def add(self, f_path, f_stat, crc, digest):
+        """
+        Add the hashes of a file that was read elsewhere.
+        
+        Args:
+            f_path (str): Path to the file.
+            f_stat (os.stat_result): Status of the file, taken before it was read.
+            crc (int): crc32 hash of the file.
+            digest (bytes): sha256 hash of the file.
+        """
+        
+        self._add(path.abspath(f_path), (f_stat.st_size, f_stat.st_mtime_ns, crc, digest))
+    
+    def reset_counters(self):
+        """Reset the counters, keeping the entries."""
+        
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+    
+    def clear(self):
+        """Remove all entries, and reset the counters."""
+        
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+    
+    def load(self, f_path):
+        """
+        Add the entries saved in a file to the cache, if the file exists.
+        
+        Args:
+            f_path (str): Path to the file, as written by 'save'.
+        """
+        
+        try:
+            f = open(f_path, 'r', encoding="utf-8")
+            entries = json.load(f)
+            f.close()
+        except (OSError, ValueError):
+            return
+        
+        #Entries of an unexpected shape are ignored, the files are then just hashed again
+        if not isinstance(entries, list):
+            return
+        for entry in entries:
+            try:
+                src_path, (size, mtime, crc, digest) = entry
+                entry = (int(size), int(mtime), int(crc), bytes.fromhex(digest))
+            except (TypeError, ValueError):
+                continue
+            if isinstance(src_path, str):
+                self._add(src_path, entry)
+    
+    def save(self, f_path):
+        """
+        Write the entries of the cache to a file, from least to most recently used.
+        
+        Args:
+            f_path (str): Path to the file.
+        """
+        
+        with self._lock:
+            entries = [[src_path, [size, mtime, crc, digest.hex()]] for src_path, (size, mtime, crc, digest) in self._entries.items()]
+        f = open(f_path, 'w', encoding="utf-8")
+        json.dump(entries, f)
+        f.close()
+    
+    def _add(self, f_path, entry):
+        with self._lock:
+            self._entries[f_path] = entry
+            self._entries.move_to_end(f_path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+#Hashes of the source files read in this session, shared by all exports
+source_hashes = HashCache()
+
+class BlibFile(object):
+    """
+    Blib file handle, which opens the archive only once,
+    and lazily loads and caches the meta-data, the member table and the bundle index.
+    
+    Can be passed instead of a file path to the functions checking and importing Blib files,
+    so that a file being checked and then imported is only opened and parsed once.
+    
+    Args:
+        f_path (str): Path to the Blib file.
+    
+    Attributes:
+        path (read-only[str]): Path to the Blib file.
+        archive (read-only[zipfile.ZipFile or None]): The open archive, None if the file is not a valid zip file.
+        meta (read-only[list[str]]): Space separated meta-data fields of the archive comment
+            (checksum, type, version, compatible version, sub-type...), empty if the meta-data is missing.
+        type (read-only[str or None]): The Blib type, None if the meta-data is missing.
+        sub_type (read-only[str or None]): The Blib sub-type, None if it is not stored in the meta-data
+            (older files, or types without sub-types).
+        members (read-only[dict]): Dictionary mapping the paths of all files in the archive to their 'zipfile.ZipInfo'.
+        asset_members (read-only[dict]): Dictionary mapping the prefixes of the assets of a bundle ("assets/<number>/")
+            to the sorted paths of the files stored for each asset, with references resolved to the referenced files.
+        checksum (read-only[str or None]): sha1 hash of the archive contents (see 'archive_sha1'), None if the file is not a valid zip file.
+        index (read-only[list[dict] or None]): Attributes of the assets listed in the "index.xml" member of a bundle, in listed order,
+            None if the archive contains no index, or if it is broken.
+    """
+    
+    def __init__(self, f_path):
+        self._path = f_path
+        self._meta = None
+        self._members = None
+        self._asset_members = None
+        self._checksum = None
+        self._index = None
+        self._index_read = False
+        try:
+            self._archive = zf.ZipFile(f_path, 'r')
+        except (zf.BadZipFile, OSError):
+            self._archive = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    @property
+    def path(self):
+        return self._path
+    
+    @property
+    def archive(self):
+        return self._archive
+    
+    @property
+    def meta(self):
+        if self._meta is None:
+            self._meta = []
+            if self._archive is not None:
+                try:
+                    self._meta = self._archive.comment.decode("utf-8").split(" ")
+                except ValueError:
+                    pass
+        return self._meta
+    
+    @property
+    def type(self):
+        if len(self.meta) > 1:
+            return self.meta[1]
+        else:
+            return None
+    
+    @property
+    def sub_type(self):
+        if len(self.meta) > 4 and self.meta[4] != "":
+            return self.meta[4]
+        else:
+            return None
+    
+    @property
+    def members(self):
+        if self._members is None:
+            self._members = {} if self._archive is None else {info.filename: info for info in self._archive.infolist()}
+        return self._members
+    
+    @property
+    def asset_members(self):
+        if self._asset_members is None:
+            self._asset_members = {}
+            if self._archive is not None:
+                for name in member_names(self._archive):
+                    if name.startswith("assets/") and name.count("/") > 1:
+                        prefix = "/".join(name.split("/", 2)[:2]) + "/"
+                        try:
+                            self._asset_members.setdefault(prefix, set()).add(get_path(self._archive, name))
+                        except KeyError:
+                            pass
+                for prefix, names in self._asset_members.items():
+                    self._asset_members[prefix] = sorted(names)
+        return self._asset_members
+    
+    @property
+    def checksum(self):
+        if self._checksum is None and self._archive is not None:
+            self._checksum = archive_sha1(self._archive).hexdigest()
+        return self._checksum
+    
+    @property
+    def index(self):
+        if not self._index_read and "index.xml" in self.members:
+            try:
+                xml_file = self._archive.open("index.xml", 'r')
+                try:
+                    xroot = ET.parse(xml_file).getroot()
+                finally:
+                    xml_file.close()
+                self._index = [dict(xasset.attrib) for xasset in xroot.iter("asset")]
+            except (ET.ParseError, zf.BadZipFile, zlib.error):
+                self._index = None
+        self._index_read = True
+        return self._index
+    
+    def close(self):
+        """Close the archive. Cached data remains available."""
+        
+        if self._archive is not None:
+            self._archive.close()
+
+class CodecPolicy(object):
+    """
+    Choose the compression to be used for each archive member, and keep statistics on the results.
+    
+    Media formats that are already compressed are stored as is. Other binary files are sampled,
+    and only deflated if the sample compresses well. The structure XML and texts use 'text_codec'.
+    
+    Args:
+        level (int): Compression level (0-9) used for deflate and bzip2.
+        text_codec (str): Compression used for the structure XML and texts ("DEFLATED", "BZIP2" or "LZMA").
+        sample_size (int): Amount of bytes from the start of a file to be sampled.
+        ratio (float): Maximum compressed to uncompressed size ratio of the sample, for the file to be deflated.
+    
+    Attributes:
+        stats (dict): Statistics per compression type, in format:
+            dict{zipfile compression constant (int): dict{
+                "members" (int): Number of members written,
+                "size" (int): Total uncompressed size,
+                "compressed" (int): Total compressed size,
+                "time" (float): Time spent writing, in seconds,
+                }}
+    """
+    
+    store_exts = {".png", ".jpg", ".jpeg", ".jp2", ".j2c", ".webp", ".avi", ".mp4", ".m4v", ".mov", ".mkv",
+                  ".mpg", ".mpeg", ".ogg", ".ogv", ".webm", ".flv", ".dv", ".zip", ".gz"}
+    codecs = {"DEFLATED": zf.ZIP_DEFLATED, "BZIP2": zf.ZIP_BZIP2, "LZMA": zf.ZIP_LZMA}
+    names = {zf.ZIP_STORED: "Stored", zf.ZIP_DEFLATED: "Deflated", zf.ZIP_BZIP2: "BZip2", zf.ZIP_LZMA: "LZMA"}
+    
+    def __init__(self, level=6, text_codec="DEFLATED", sample_size=1 << 16, ratio=0.9):
+        self.level = level
+        self.text_codec = self.codecs[text_codec]
+        self.sample_size = sample_size
+        self.ratio = ratio
+        self.stats = {}
+        self._lock = Lock()
+    
+    def choose(self, source, destination):
+        """
+        Choose compression for a member.
+        
+        Args:
+            source (str or bytes): The path to the file to be written or the data itself.
+            destination (str): The path within the archive to which the data should written.
+        
+        Returns:
+            (compress_type, level)
+            compress_type (int): zipfile compression constant.
+            level (int or None): Compression level.
+        """
+        
+        #Members of the assets in a bundle are stored under "assets/<number>/"
+        name = destination.split("/", 2)[-1] if destination.startswith("assets/") else destination
+        if name in {"structure.xml", "index.xml", "references.xml"} or name.startswith("texts/"):
+            return self.text_codec, max(self.level, 1) if self.text_codec == zf.ZIP_BZIP2 else self.level
+        
+        ext = path.splitext(source if isinstance(source, str) else destination)[1].lower()
+        if ext in self.store_exts:
+            return zf.ZIP_STORED, None
+        
+        if isinstance(source, str):
+            f = open(source, 'rb')
+            sample = f.read(self.sample_size)
+            f.close()
+        else:
+            sample = source[:self.sample_size]
+        
+        if len(zlib.compress(sample, 1)) > len(sample) * self.ratio:
+            return zf.ZIP_STORED, None
+        return zf.ZIP_DEFLATED, self.level
+    
+    def record(self, zinfo, seconds):
+        """
+        Add a written member to the statistics.
+        
+        Args:
+            zinfo (zipfile.ZipInfo): Info of the written member.
+            seconds (float): Time spent compressing and writing the member.
+        """
+        
+        with self._lock:
+            stats = self.stats.setdefault(zinfo.compress_type, {"members": 0, "size": 0, "compressed": 0, "time": 0.0})
+            stats["members"] += 1
+            stats["size"] += zinfo.file_size
+            stats["compressed"] += zinfo.compress_size
+            stats["time"] += seconds
+    
+    def report(self):
+        """
+        Generate a human readable report of the statistics.
+        
+        Returns:
+            list[str]: One line per compression type.
+        """
+        
+        lines = []
+        for compress_type, stats in sorted(self.stats.items()):
+            lines.append("{}: {} files, {} bytes, {} bytes saved, {:.2f}s".format(
+                self.names[compress_type], stats["members"], stats["size"],
+                stats["size"] - stats["compressed"], stats["time"]))
+        return lines
+
+class ParallelWriter(object):
+    """
+    Compress archive members on a pool of worker threads, and commit them to the archive in submission order.
+    
+    Only reading, hashing and compressing the data happens on the worker threads, the deduplication and all
+    modifications to the archive are done on the calling thread, so the resulting archive is the same as
+    when writing every member with 'write' (including the crc32 hashes used by 'archive_sha1').
+    
+    Using 'destination in instance' checks if a member was written, or is pending to be written.
+    
+    Args:
+        archive (zipfile.ZipFile): The archive to which to write the data.
+        index (dict): Deduplication index of the archive (see 'write').
+        threads (int): Number of worker threads. 0 uses one thread per CPU core,
+            and 1 writes every member directly on the calling thread.
+        policy (blib.utils.CodecPolicy or None): Policy choosing the compression of each member,
+            if None, the compression of the archive is used for all members.
+        max_size (int): Files larger than this amount of bytes are not loaded into memory,
+            and are instead compressed while writing, on the calling thread.
+    """
+    
+    def __init__(self, archive, index, threads=0, policy=None, max_size=64 << 20):
+        if threads <= 0:
+            threads = cpu_count() or 1
+        self._archive = archive
+        self._index = index
+        self._policy = policy
+        self._max_size = max_size
+        self._window = threads * 2
+        self._pending = deque()
+        self._names = set()
+        self._pool = ThreadPoolExecutor(threads) if threads > 1 and raw_access(archive) else None
+    
+    def __contains__(self, destination):
+        return destination in self._names
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            for pending in self._pending:
+                pending[2].cancel()
+            self._pending.clear()
+            if self._pool is not None:
+                self._pool.shutdown()
+    
+    def write(self, source, destination):
+        """
+        Queue data to be written to the archive (see 'write').
+        
+        Args:
+            source (str or bytes): The path to the file to be written or the data itself.
+            destination (str): The path within the archive to which the data should written.
+        
+        Raises:
+            TypeError: If the 'source' argument is not a 'str' or 'bytes' object.
+        """
+        
+        if not isinstance(source, (str, bytes)):
+            raise TypeError("source should be of type 'str' or 'bytes', not '{}'".format(type(source).__name__))
+        
+        self._names.add(destination)
+        if self._pool is None or (isinstance(source, str) and path.getsize(source) > self._max_size):
+            self.flush()
+            write(self._archive, source, destination, self._index, self._policy)
+        else:
+            future = self._pool.submit(compress_member, source, destination, self._archive.compression, self._policy)
+            self._pending.append((source, destination, future))
+            while len(self._pending) > self._window:
+                self._commit()
+    
+    def flush(self):
+        """Write all pending members to the archive."""
+        
+        while self._pending:
+            self._commit()
+    
+    def close(self):
+        """Write all pending members to the archive, and stop the worker threads."""
+        
+        self.flush()
+        if self._pool is not None:
+            self._pool.shutdown()
+    
+    def _commit(self):
+        source, destination, future = self._pending.popleft()
+        zinfo, key, data, seconds = future.result()
+        if key in self._index:
+            write_link(self._archive, destination, self._index[key])
+        else:
+            start = perf_counter()
+            write_raw(self._archive, zinfo, data)
+            if self._policy is not None:
+                self._policy.record(zinfo, seconds + perf_counter() - start)
+            self._index[key] = destination
+
+class Verifier(object):
+    """
+    Check the integrity of archive members on a pool of worker threads, while the calling thread keeps working.
+    
+    The data of the members in 'keep' is kept in memory while checking them, so that members which are read
+    after being checked (e.g. small texts) are only decompressed once.
+    
+    Args:
+        archive (zipfile.ZipFile): The archive containing the members to be checked.
+        names (list[str]): The paths of the members to be checked.
+        threads (int): Number of worker threads, 0 uses one thread per CPU core.
+        keep (set[str]): The paths of the members, among 'names', of which to keep the data.
+    
+    Attributes:
+        kept (read-only[dict]): Dictionary mapping the paths of the intact members in 'keep' to their data,
+            complete once 'result' has returned.
+    """
+    
+    def __init__(self, archive, names, threads=0, keep=frozenset()):
+        if threads <= 0:
+            threads = cpu_count() or 1
+        self._result = None
+        self._done = False
+        self._kept = {}
+        self._pool = ThreadPoolExecutor(threads)
+        self._futures = [(name, self._pool.submit(read_member if name in keep else test_member, archive, name)) for name in names]
+    
+    @property
+    def kept(self):
+        return self._kept
+    
+    def result(self):
+        """
+        Wait for all checks to finish.
+        
+        Returns:
+            str or None: The path of the first broken member, or None if all members are intact.
+        """
+        
+        if not self._done:
+            for name, future in self._futures:
+                intact = future.result()
+                if isinstance(intact, bytes):
+                    self._kept[name] = intact
+                elif not intact and self._result is None:
+                    self._result = name
+            self._done = True
+            self._pool.shutdown()
+        return self._result
+    
+    def close(self):
+        """Cancel all pending checks, and stop the worker threads."""
+        
+        for name, future in self._futures:
+            future.cancel()
+        self._done = True
+        self._pool.shutdown()
+
+class Extractor(object):
+    """
+    Extract archive members on a pool of worker threads, while the calling thread keeps working.
+    
+    Args:
+        archive (zipfile.ZipFile): The archive from which to extract.
+        threads (int): Number of worker threads, 0 uses one thread per CPU core.
+    """
+    
+    def __init__(self, archive, threads=0):
+        if threads <= 0:
+            threads = cpu_count() or 1
+        self._archive = archive
+        self._pool = ThreadPoolExecutor(threads)
+        self._futures = []
+    
+    def submit(self, item, directory):
+        """
+        Start extracting an item (see 'extract').
+        
+        Args:
+            item (str): The path to the item inside the archive.
+            directory (str): The path to the directory to which to extract.
+        
+        Returns:
+            str: Path to the extracted file, which is only complete once 'wait' has returned.
+        
+        Raises:
+            KeyError: If the item is not in the archive.
+        """
+        
+        get_path(self._archive, item)
+        self._futures.append(self._pool.submit(extract, self._archive, item, directory))
+        return path.join(directory, path.basename(item))
+    
+    def wait(self):
+        """
+        Wait for all started extractions to finish.
+        
+        Raises:
+            zipfile.BadZipFile: If any of the items is broken, once all others have been extracted.
+            Exception: The first error of any other extraction that failed (e.g. 'OSError' if the disk is full),
+                also raised only once all others have finished.
+        """
+        
+        futures = self._futures
+        self._futures = []
+        error = None
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                if error is None:
+                    error = e
+        if error is not None:
+            raise error
+    
+    def close(self):
+        """Cancel all pending extractions, and stop the worker threads once the running ones are done."""
+        
+        for future in self._futures:
+            future.cancel()
+        self._futures = []
+        self._pool.shutdown()
+
+#Reference tables of the open archives, by archive (see 'references')
+reference_tables = WeakKeyDictionary()
+reference_lock = Lock()
+
+def references(archive):
+    """
+    Get the reference table of an archive, loading it only on first use.
+    
+    Duplicate files are stored once, and every other path to them is listed in the table, saved as the "references.xml" member.
+    Archives being written start with an empty table, filled by 'write_link' and saved by 'store_references'.
+    
+    Args:
+        archive (zipfile.ZipFile): The archive.
+    
+    Returns:
+        dict: Dictionary mapping the paths of the references to the paths of the referenced files.
+    
+    Raises:
+        zipfile.BadZipFile: If the table is broken.
+    """
+    
+    with reference_lock:
+        table = reference_tables.get(archive)
+        if table is None:
+            table = {}
+            if archive.mode == 'r' and "references.xml" in archive.NameToInfo:
+                try:
+                    xml_file = archive.open("references.xml", 'r')
+                    try:
+                        xroot = ET.parse(xml_file).getroot()
+                    finally:
+                        xml_file.close()
+                    for xref in xroot.iter("reference"):
+                        table[xref.attrib["path"]] = xref.attrib["target"]
+                except (ET.ParseError, KeyError, zlib.error) as e:
+                    raise zf.BadZipFile("Broken reference table: {}".format(e))
+            reference_tables[archive] = table
+    return table
+
+def store_references(archive):
+    """
+    Save the reference table of an archive being written (see 'references').
+    
+    Args:
+        archive (zipfile.ZipFile): The archive.
+    
+    Returns:
+        bool: True if the table was saved, False if the archive contains no references.
+    """
+    
+    table = references(archive)
+    if not table:
+        return False
+    
+    xroot = ET.Element("references")
+    for ref_path, target in sorted(table.items()):
+        ET.SubElement(xroot, "reference", {"path": ref_path, "target": target})
+    store(archive, ET.tostring(xroot, encoding="utf-8"), "references.xml")
+    return True
+
+def member_names(archive):
+    """Get the paths of all files in the archive, including those that are references to other files."""
+    
+    return archive.namelist() + list(references(archive))
 
 def get_path(archive, item):
     """
-    Resolve reference chain.
+    Resolve reference.
     
     Args:
         archive (zipfile.ZipFile): The archive wherein the file is located.
@@ -200,9 +1270,14 @@ def get_path(archive, item):
     
     Returns:
         str: Path to the file within the archive.
+    
+    Raises:
+        KeyError: If the file is not in the archive.
     """
     
-    fpath = item
+    fpath = references(archive).get(item, item)
+    
+    #Files written before version 0.4.0 store references in the comments of empty members, which can be chained
     while True:
         comment = archive.getinfo(fpath).comment.decode("utf-8")
         if comment == "":
@@ -222,17 +1297,188 @@ def extract(archive, item, directory):
     
     Returns:
         str: Path to the extracted file.
+    
+    Raises:
+        zipfile.BadZipFile: If the item is broken, in which case no file is left in 'directory'.
     """
     
     d_path = path.join(directory, path.basename(item))
     s_path = get_path(archive, item)
+    
+    #Stored members are copied straight from the archive file, without going through zipfile
+    zinfo = archive.getinfo(s_path)
+    if zinfo.compress_type == zf.ZIP_STORED and not zinfo.flag_bits & 0x01 and archive.filename is not None:
+        extract_stored(archive.filename, zinfo, d_path)
+        return d_path
+    
     src = archive.open(s_path, 'r')
     dst = open(d_path, 'wb')
-    copyfileobj(src, dst)
-    src.close()
+    try:
+        copyfileobj(src, dst)
+    except (zf.BadZipFile, zlib.error, EOFError) as e:
+        dst.close()
+        remove(d_path)
+        raise zf.BadZipFile("Broken file '{}' in archive: {}".format(s_path, e))
+    finally:
+        src.close()
     dst.close()
     return d_path
 
+def data_offset(f, zinfo):
+    """
+    Find where the data of an archive member starts, by reading its local header.
+    
+    Args:
+        f (file object): The archive file, opened in binary mode.
+        zinfo (zipfile.ZipInfo): Info of the member.
+    
+    Returns:
+        int: Offset of the member's data from the start of the file.
+    
+    Raises:
+        zipfile.BadZipFile: If the member's header is broken.
+    """
+    
+    f.seek(zinfo.header_offset)
+    fheader = f.read(zf.sizeFileHeader)
+    if len(fheader) != zf.sizeFileHeader:
+        raise zf.BadZipFile("Truncated file header")
+    fheader = struct.unpack(zf.structFileHeader, fheader)
+    if fheader[zf._FH_SIGNATURE] != zf.stringFileHeader:
+        raise zf.BadZipFile("Bad magic number for file header")
+    return zinfo.header_offset + zf.sizeFileHeader + fheader[zf._FH_FILENAME_LENGTH] + fheader[zf._FH_EXTRA_FIELD_LENGTH]
+
+def extract_stored(filename, zinfo, d_path, chunk_size=1 << 24):
+    """
+    Extract an uncompressed archive member, by copying its data range from the archive file.
+    The copy is done by the kernel where supported, otherwise it is written from a memory map of the archive
+    while being checked against the member's crc32 hash. Data copied by the kernel is checked through the memory map.
+    If anything fails, no partial file is left at 'd_path'.
+    
+    Args:
+        filename (str): Path to the archive file.
+        zinfo (zipfile.ZipInfo): Info of the member, which must be stored without compression or encryption.
+        d_path (str): Path of the file to which to extract.
+        chunk_size (int): Number of bytes copied and hashed at a time.
+    
+    Raises:
+        zipfile.BadZipFile: If the member is broken, in which case no file is left at 'd_path'.
+    """
+    
+    src = open(filename, 'rb')
+    try:
+        dst = open(d_path, 'wb')
+    except:
+        src.close()
+        raise
+    
+    #No partial file is left behind, whatever goes wrong
+    try:
+        try:
+            offset = data_offset(src, zinfo)
+            size = zinfo.file_size
+            if offset + size > stat(filename).st_size:
+                raise zf.BadZipFile("Truncated file '{}' in archive".format(zinfo.filename))
+            
+            crc = zlib.crc32(b"")
+            if size > 0:
+                #Memory maps must start at a multiple of the allocation granularity
+                start = offset - offset % mmap.ALLOCATIONGRANULARITY
+                with mmap.mmap(src.fileno(), offset - start + size, access=mmap.ACCESS_READ, offset=start) as data:
+                    view = memoryview(data)[offset - start:]
+                    try:
+                        #Whatever the kernel did not copy is hashed while it is written
+                        copied = copy_range(src.fileno(), dst.fileno(), offset, size)
+                        for pos in range(0, copied, chunk_size):
+                            crc = zlib.crc32(view[pos:min(pos + chunk_size, copied)], crc)
+                        dst.seek(copied)
+                        for pos in range(copied, size, chunk_size):
+                            crc = zlib.crc32(view[pos:pos + chunk_size], crc)
+                            dst.write(view[pos:pos + chunk_size])
+                    finally:
+                        view.release()
+            
+            if crc != zinfo.CRC:
+                raise zf.BadZipFile("Bad CRC-32 for file '{}'".format(zinfo.filename))
+        finally:
+            dst.close()
+    except zf.BadZipFile as e:
+        remove(d_path)
+        raise zf.BadZipFile("Broken file '{}' in archive: {}".format(zinfo.filename, e))
+    except:
+        remove(d_path)
+        raise
+    finally:
+        src.close()
+
+def copy_range(fd_in, fd_out, offset, count):
+    """
+    Copy a range of bytes from a file to the start of another, inside the kernel.
+    
+    Args:
+        fd_in (int): File descriptor of the file to copy from.
+        fd_out (int): File descriptor of the file to copy to.
+        offset (int): Position in the source file of the first byte to copy.
+        count (int): Number of bytes to copy.
+    
+    Returns:
+        int: The number of bytes copied, which is less than 'count' if the rest
+        has to be copied in user space, because kernel copies are unavailable or failed.
+    """
+    
+    copied = 0
+    while copied < count:
+        try:
+            if copy_file_range is not None:
+                done = copy_file_range(fd_in, fd_out, count - copied, offset + copied, copied)
+            elif sendfile is not None:
+                done = sendfile(fd_out, fd_in, offset + copied, count - copied)
+            else:
+                break
+        except OSError:
+            break
+        if done <= 0:
+            break
+        copied += done
+    return copied
+
+def test_member(archive, name):
+    """
+    Check the integrity of a member of a ZIP archive, by decompressing it and verifying its CRC.
+    
+    Args:
+        archive (zipfile.ZipFile): The archive containing the member.
+        name (str): The path of the member inside the archive.
+    
+    Returns:
+        bool: True if the member is intact, otherwise False (also if it is missing).
+    """
+    
+    try:
+        with archive.open(name, 'r') as member:
+            while member.read(1 << 20):
+                pass
+    except (zf.BadZipFile, zlib.error, EOFError, KeyError):
+        return False
+    return True
+
+def read_member(archive, name):
+    """
+    Read a member of a ZIP archive, verifying its CRC (see 'test_member').
+    
+    Args:
+        archive (zipfile.ZipFile): The archive containing the member.
+        name (str): The path of the member inside the archive.
+    
+    Returns:
+        bytes or None: The data of the member, or None if it is broken or missing.
+    """
+    
+    try:
+        return archive.read(name)
+    except (zf.BadZipFile, zlib.error, EOFError, KeyError):
+        return None
+
 def fail(failed, f_type, action):
     """
     Increment fail counter and print fail to console.
@@ -248,28 +1494,6 @@ def fail(failed, f_type, action):
     failed[f_type] += 1
     print("Failed to {}.".format(action))
 
-def files_equal(file1, file2):
-    """
-    Check if files contain same data.
-    
-    Args:
-        file1, file2 (file object): Files should be loaded in the same mode (i.e. binary or text),
-            otherwise equal files may seem different.
-    
-    Returns:
-        bool
-    """
-    
-    while True:
-        data1 = file1.read(1024)
-        data2 = file2.read(1024)
-        
-        if data1 != data2:
-            return False
-        
-        if not data1 and not data2:
-            return True
-
 def archive_sha1(archive):
     """
     Generate sha1 hash from crc32 hashes of all files in archive.
@@ -288,7 +1512,8 @@ def archive_sha1(archive):
 
 def gen_crc(filepath):
     """
-    Generate crc32 hash, without loading whole file to disk.
+    Generate crc32 hash, without loading whole file to memory.
+    Files that were already hashed in this session are only read again if they changed (see 'source_hashes').
     
     Args:
         filepath (str): Path to file to be hashed.
@@ -297,18 +1522,59 @@ def gen_crc(filepath):
         int: crc32 hash in decimal form.
     """
     
-    f = open(filepath, 'rb')
-    crc = crc32(b"")
-    while True:
-        data = f.read(1024)
-        if data:
-            crc = crc32(data, crc)
-        else:
-            break
-    f.close()
-    return crc
+    return source_hashes.get(filepath)[0]
+
+def gen_hash(source):
+    """
+    Generate the deduplication key of some data, without loading whole file to memory.
+    Files that were already hashed in this session are only read again if they changed (see 'source_hashes').
+    
+    Args:
+        source (str or bytes): The path to the file to be hashed or the data itself.
+    
+    Returns:
+        (size, digest)
+        size (int): Size of the data in bytes.
+        digest (bytes): sha256 hash of the data.
+    """
+    
+    if isinstance(source, bytes):
+        return len(source), sha256(source).digest()
+    
+    crc, size, digest = source_hashes.get(source)
+    return size, digest
 
-def write(archive, source, destination, crcs):
+def member_hash(archive, name):
+    """
+    Generate the deduplication key of an archive member (see 'gen_hash'), by reading it.
+    
+    Args:
+        archive (zipfile.ZipFile): The archive containing the member.
+        name (str): The path of the member inside the archive (references are not resolved).
+    
+    Returns:
+        (size, digest): The size and sha256 hash of the uncompressed member.
+    
+    Raises:
+        zipfile.BadZipFile: If the member is broken.
+    """
+    
+    size = 0
+    digest = sha256()
+    try:
+        with archive.open(name, 'r') as member:
+            while True:
+                data = member.read(1 << 20)
+                if data:
+                    size += len(data)
+                    digest.update(data)
+                else:
+                    break
+    except (zlib.error, EOFError) as e:
+        raise zf.BadZipFile("Broken file '{}' in archive: {}".format(name, e))
+    return size, digest.digest()
+
+def write(archive, source, destination, index, policy=None):
     """
     Write data to archive, while only making a link if identical data is already in archive.
     
@@ -318,40 +1584,300 @@ def write(archive, source, destination, crcs):
             If source is 'str', it is interpreted as a file path.
             If source is 'bytes', it is interpreted as data to be written directly.
         destination (str): The path within the archive to which the data should written.
-        crcs (dict): A dictionary containing crc32 hashes to all files in archive.
+        index (dict): Deduplication index, mapping the (size, sha256 digest) keys of the data
+            in the archive (see 'gen_hash'), to its path within the archive.
             Can be passed as an empty dictionary.
             Same dict should be passed every time you write to the same archive.
+        policy (blib.utils.CodecPolicy or None): Policy choosing the compression of the data,
+            if None, the compression of the archive is used.
     
     Raises:
         TypeError: If the 'source' argument is not a 'str' or 'bytes' object.
     """
     
-    if isinstance(source, str):
-        is_file = True
-    elif isinstance(source, bytes):
-        is_file = False
-    else:
+    if not isinstance(source, (str, bytes)):
         raise TypeError("source should be of type 'str' or 'bytes', not '{}'".format(type(source).__name__))
     
-    crc = gen_crc(source) if is_file else crc32(source)
-    if crc in crcs:
-        for zpath in crcs[crc]:
-            zfile = archive.open(zpath, 'r')
-            nfile = open(source, 'rb') if is_file else BytesIO(source)
-            if files_equal(zfile, nfile):
-                archive.writestr(destination, b"")
-                archive.getinfo(destination).comment = zpath.encode("utf-8")
-                zfile.close()
-                nfile.close()
-                break
-            zfile.close()
-            nfile.close()
+    #Files that were not hashed yet are hashed while they are written, so that they are only read once,
+    #and the written member is dropped again if it turns out to be a duplicate
+    if isinstance(source, bytes):
+        key = gen_hash(source)
+    elif raw_access(archive) and archive._seekable:
+        key = source_hashes.peek(source)
+        key = key[1:] if key is not None else None
+    else:
+        key = gen_hash(source)
+    
+    if key is None:
+        start = perf_counter()
+        key = stream_member(archive, source, destination, policy)
+        if key in index:
+            drop_member(archive, destination)
+            write_link(archive, destination, index[key])
+        else:
+            if policy is not None:
+                policy.record(archive.getinfo(destination), perf_counter() - start)
+            index[key] = destination
+    elif key in index:
+        write_link(archive, destination, index[key])
+    else:
+        store(archive, source, destination, policy)
+        index[key] = destination
+
+def stream_member(archive, source, destination, policy=None):
+    """
+    Write a file to an archive, with the same member attributes as 'store' would give it,
+    while hashing it, and adding its hashes to 'source_hashes'.
+    
+    Args:
+        archive (zipfile.ZipFile): The archive to which to write the file.
+        source (str): The path to the file to be written.
+        destination (str): The path within the archive to which the file should written.
+        policy (blib.utils.CodecPolicy or None): Policy choosing the compression of the file,
+            if None, the compression of the archive is used.
+    
+    Returns:
+        (size, digest): Deduplication key of the file (see 'gen_hash').
+    """
+    
+    f_stat = stat(source)
+    zinfo = zf.ZipInfo.from_file(source, destination)
+    zinfo.compress_type = archive.compression
+    zinfo._compresslevel = archive.compresslevel
+    if policy is not None:
+        compress_type, level = policy.choose(source, destination)
+        zinfo.compress_type = compress_type
+        if level is not None:
+            zinfo._compresslevel = level
+    
+    digest = sha256()
+    src = open(source, 'rb')
+    try:
+        with archive.open(zinfo, 'w') as dst:
+            while True:
+                data = src.read(1 << 20)
+                if data:
+                    digest.update(data)
+                    dst.write(data)
+                else:
+                    break
+    finally:
+        src.close()
+    
+    #zipfile computes the crc32 hash while writing
+    source_hashes.add(source, f_stat, zinfo.CRC, digest.digest())
+    return f_stat.st_size, digest.digest()
+
+def drop_member(archive, name):
+    """
+    Remove the last member written to an archive, truncating the archive file.
+    
+    Args:
+        archive (zipfile.ZipFile): The archive, which has to be seekable, and support 'raw_access'.
+        name (str): The path of the member within the archive, which has to be the last one written.
+    """
+    
+    with archive._lock:
+        zinfo = archive.NameToInfo.pop(name)
+        archive.filelist.remove(zinfo)
+        archive.fp.seek(zinfo.header_offset)
+        archive.fp.truncate()
+        archive.start_dir = zinfo.header_offset
+
+def store(archive, source, destination, policy=None):
+    """
+    Write data to archive, without checking for duplicates.
+    
+    Args:
+        archive (zipfile.ZipFile): The archive to which to write the data.
+        source (str or bytes): The path to the file to be written or the data itself (see 'write').
+        destination (str): The path within the archive to which the data should written.
+        policy (blib.utils.CodecPolicy or None): Policy choosing the compression of the data,
+            if None, the compression of the archive is used.
+    """
+    
+    if policy is None:
+        archive.write(source, destination) if isinstance(source, str) else archive.writestr(destination, source)
+    else:
+        compress_type, level = policy.choose(source, destination)
+        start = perf_counter()
+        if isinstance(source, str):
+            archive.write(source, destination, compress_type, level)
         else:
-            archive.write(source, destination) if is_file else archive.writestr(destination, source)
-            crcs[crc].append(destination)
+            archive.writestr(destination, source, compress_type, level)
+        policy.record(archive.getinfo(destination), perf_counter() - start)
+
+def open_member(archive, destination, policy=None):
+    """
+    Open an archive member for writing, so that its data can be written incrementally,
+    with the same member attributes as 'store' would give it.
+    
+    Args:
+        archive (zipfile.ZipFile): The archive to which to write the data.
+        destination (str): The path within the archive to which the data should written.
+        policy (blib.utils.CodecPolicy or None): Policy choosing the compression of the data,
+            if None, the compression of the archive is used. As the data is not available beforehand,
+            it can't be sampled, so this is meant for the structure XML and texts.
+    
+    Returns:
+        file object: Writable file object, which has to be closed before writing other members.
+    """
+    
+    zinfo = zf.ZipInfo(destination, localtime()[:6])
+    zinfo.compress_type = archive.compression
+    zinfo._compresslevel = archive.compresslevel
+    zinfo.external_attr = 0o600 << 16
+    if policy is not None:
+        compress_type, level = policy.choose(b"", destination)
+        zinfo.compress_type = compress_type
+        if level is not None:
+            zinfo._compresslevel = level
+    return archive.open(zinfo, 'w')
+
+def write_link(archive, destination, zpath):
+    """
+    Write a reference to a file that is already in the archive, to its reference table (see 'references').
+    
+    Args:
+        archive (zipfile.ZipFile): The archive to which to write the reference.
+        destination (str): The path within the archive to which the reference should be written.
+        zpath (str): The path within the archive of the referenced file.
+    """
+    
+    references(archive)[destination] = zpath
+
+def compress_member(source, destination, compression, policy=None):
+    """
+    Load and compress data, to be written to an archive with 'write_raw'.
+    
+    Does not modify any archive, and can thus be safely called from worker threads.
+    
+    Args:
+        source (str or bytes): The path to the file to be compressed or the data itself.
+        destination (str): The path within the archive to which the data should written.
+        compression (int): zipfile compression constant, used if 'policy' is None.
+        policy (blib.utils.CodecPolicy or None): Policy choosing the compression of the data.
+    
+    Returns:
+        (zinfo, key, data, seconds)
+        zinfo (zipfile.ZipInfo): Info of the member, with sizes and crc32 hash filled in.
+        key (tuple): Deduplication key of the uncompressed data (see 'gen_hash').
+        data (bytes): The compressed data.
+        seconds (float): Time spent compressing the data.
+    """
+    
+    level = None
+    if policy is not None:
+        compression, level = policy.choose(source, destination)
+    
+    if isinstance(source, str):
+        zinfo = zf.ZipInfo.from_file(source, destination)
+        f = open(source, 'rb')
+        data = f.read()
+        f.close()
     else:
-        archive.write(source, destination) if is_file else archive.writestr(destination, source)
-        crcs[crc] = [destination]
+        zinfo = zf.ZipInfo(destination, localtime()[:6])
+        zinfo.external_attr = 0o600 << 16
+        data = source
+    
+    start = perf_counter()
+    zinfo.compress_type = compression
+    zinfo.file_size = len(data)
+    zinfo.CRC = zlib.crc32(data)
+    key = gen_hash(data)
+    compressor = zf._get_compressor(compression, level)
+    if compressor is not None:
+        data = compressor.compress(data) + compressor.flush()
+    zinfo.compress_size = len(data)
+    return zinfo, key, data, perf_counter() - start
+
+def raw_access(archive):
+    """
+    Check if members can be written straight to the file of an archive ('write_raw' and 'drop_member').
+    
+    This relies on zipfile internals, so if they are missing (e.g. changed by a newer Python version),
+    callers use the public zipfile interface instead, rather than risk writing broken archives.
+    
+    Args:
+        archive (zipfile.ZipFile): The archive to be written.
+    
+    Returns:
+        bool: True if the internals are available.
+    """
+    
+    return hasattr(zf, "_get_compressor") and hasattr(zf.ZipInfo, "FileHeader") and \
+           all(hasattr(archive, attr) for attr in ("_lock", "_writecheck", "_didModify", "_seekable", "fp", "start_dir"))
+
+def write_raw(archive, zinfo, data):
+    """
+    Write already compressed data to archive, which has to support 'raw_access'.
+    
+    Args:
+        archive (zipfile.ZipFile): The archive to which to write the data.
+        zinfo (zipfile.ZipInfo): Info of the member, with compression, sizes and crc32 hash filled in.
+        data (bytes or file object): The compressed data, as produced by 'compress_member',
+            or a file positioned at the start of the compressed data, from which it is copied in chunks.
+    """
+    
+    if zinfo.compress_type == zf.ZIP_LZMA:
+        zinfo.flag_bits |= 0x02 #End-of-stream marker, as set by zipfile
+    zip64 = zinfo.file_size * 1.05 > zf.ZIP64_LIMIT or zinfo.compress_size > zf.ZIP64_LIMIT
+    with archive._lock:
+        if archive._seekable:
+            archive.fp.seek(archive.start_dir)
+        zinfo.header_offset = archive.fp.tell()
+        archive._writecheck(zinfo)
+        archive._didModify = True
+        archive.fp.write(zinfo.FileHeader(zip64))
+        if isinstance(data, bytes):
+            archive.fp.write(data)
+        else:
+            remaining = zinfo.compress_size
+            while remaining:
+                chunk = data.read(min(remaining, 1 << 20))
+                if not chunk:
+                    raise zf.BadZipFile("Truncated file '{}' in archive".format(zinfo.filename))
+                archive.fp.write(chunk)
+                remaining -= len(chunk)
+        archive.start_dir = archive.fp.tell()
+        archive.filelist.append(zinfo)
+        archive.NameToInfo[zinfo.filename] = zinfo
+
+def copy_raw(source, name, archive, destination):
+    """
+    Copy a member from an archive to another, without decompressing and compressing it again,
+    unless 'archive' does not support 'raw_access'.
+    
+    Args:
+        source (zipfile.ZipFile): The archive containing the member, opened from a file path.
+        name (str): The path of the member inside 'source' (references are not resolved).
+        archive (zipfile.ZipFile): The archive to which to copy the member.
+        destination (str): The path within 'archive' to which the member should be copied.
+    
+    Raises:
+        zipfile.BadZipFile: If the member's header is broken.
+    """
+    
+    zinfo = source.getinfo(name)
+    new_info = zf.ZipInfo(destination, zinfo.date_time)
+    new_info.compress_type = zinfo.compress_type
+    new_info.external_attr = zinfo.external_attr
+    new_info.create_system = zinfo.create_system
+    new_info.CRC = zinfo.CRC
+    new_info.file_size = zinfo.file_size
+    new_info.compress_size = zinfo.compress_size
+    
+    if not raw_access(archive):
+        with source.open(name, 'r') as src, archive.open(new_info, 'w') as dst:
+            copyfileobj(src, dst)
+        return
+    
+    f = open(source.filename, 'rb')
+    try:
+        f.seek(data_offset(f, zinfo))
+        write_raw(archive, new_info, f)
+    finally:
+        f.close()
 
 def is_int(string):
     """
@@ -388,7 +1914,7 @@ def get_file_type(f_path):
     Get the Blib type of a file.
     
     Args:
-        f_path (str): Path to the file to be checked.
+        f_path (str or blib.utils.BlibFile): Path to the file to be checked, or the already open file.
     
     Returns:
         str or None
@@ -396,15 +1922,8 @@ def get_file_type(f_path):
         if no valid type is found, None is returned.
     """
     
-    try:
-        archive = zf.ZipFile(f_path, 'r')
-    except zf.BadZipFile:
-        return None
-    
-    try:
-        blib_type = archive.comment.decode("utf-8").split(" ")[1]
-    except ValueError:
-        return None
+    if isinstance(f_path, BlibFile):
+        return f_path.type
     
-    archive.close()
-    return blib_type
+    with BlibFile(f_path) as blib_file:
+        return blib_file.type
@@ -21,15 +21,18 @@
 
 import bpy
 
-from bpy.props import StringProperty, BoolProperty, EnumProperty, CollectionProperty, PointerProperty
+from bpy.props import StringProperty, BoolProperty, IntProperty, EnumProperty, CollectionProperty, PointerProperty
 
 try:
     import blib as ext_blib
 except ImportError:
     from .blib.cycles import bexport as export_cycles
     from .blib.cycles import bimport as import_cycles
+    from .blib.cycles.bexport import bexport_bundle as export_cycles_bundle
+    from .blib.cycles.generate_xml import ExportSession as CyclesExportSession
     from .blib.cycles.utils import check_asset as is_cycles_asset
     from .blib.cycles.utils import check_file as is_cycles_file
+    from .blib.cycles.utils import read_index as read_cycles_index
     from .blib.utils import gen_resource_path
 else:
     from . import blib as loc_blib
@@ -38,14 +41,20 @@ else:
     if loc_ver >= ext_ver:
         from .blib.cycles import bexport as export_cycles
         from .blib.cycles import bimport as import_cycles
+        from .blib.cycles.bexport import bexport_bundle as export_cycles_bundle
+        from .blib.cycles.generate_xml import ExportSession as CyclesExportSession
         from .blib.cycles.utils import check_asset as is_cycles_asset
         from .blib.cycles.utils import check_file as is_cycles_file
+        from .blib.cycles.utils import read_index as read_cycles_index
         from .blib.utils import gen_resource_path
     else:
         from blib.cycles import bexport as export_cycles
         from blib.cycles import bimport as import_cycles
+        from blib.cycles.bexport import bexport_bundle as export_cycles_bundle
+        from blib.cycles.generate_xml import ExportSession as CyclesExportSession
         from blib.cycles.utils import check_asset as is_cycles_asset
         from blib.cycles.utils import check_file as is_cycles_file
+        from blib.cycles.utils import read_index as read_cycles_index
         from blib.utils import gen_resource_path
 
 #Generic item for single asset
@@ -108,6 +117,32 @@ class CyclesExportProps(bpy.types.PropertyGroup):
         description='Reduce file size slightly, by not including "blank" variables (Increases risk of broken or incompatible files)',
         default=False
     )
+    
+    threads = IntProperty(
+        name="Threads",
+        description="Number of threads used to compress the exported files (0 to use one thread per CPU core)",
+        default=0,
+        min=0
+    )
+    
+    compress_level = IntProperty(
+        name="Compression level",
+        description="Compression level for files that can be compressed (higher is smaller but slower)",
+        default=6,
+        min=0,
+        max=9
+    )
+    
+    text_codec = EnumProperty(
+        name="Text compression",
+        description="Compression method used for the material structure and texts",
+        items=(
+            ("DEFLATED", "Deflate", "Fast, compatible with any zip tool"),
+            ("BZIP2", "BZip2", "Smaller than deflate, but slower"),
+            ("LZMA", "LZMA", "Smallest, but slowest")
+        ),
+        default="DEFLATED"
+    )
 
 #Properties for Cycles import
 class CyclesImportProps(bpy.types.PropertyGroup):
@@ -191,6 +226,13 @@ class CyclesImportProps(bpy.types.PropertyGroup):
         description="Skip file corruption verification (only use if you manually edited the file, and know what you're doing)",
         default=False
     )
+    
+    threads = IntProperty(
+        name="Threads",
+        description="Number of threads used to verify the imported file (0 to use one thread per CPU core)",
+        default=0,
+        min=0
+    )
 
 
 ### ASSET TYPE CONTAINERS ###
@@ -235,6 +277,24 @@ class BlibThings(bpy.types.PropertyGroup):
         default = "replace"
     )
     
+    incremental = BoolProperty(
+        name = "Incremental export",
+        description = "Only write the assets that changed since they were last exported to the same directory, and copy their unchanged resources from the existing files",
+        default = False
+    )
+    
+    bundle = BoolProperty(
+        name = "Export as bundle",
+        description = "Save all selected assets to a single file, storing shared resources only once",
+        default = False
+    )
+    
+    import_names = StringProperty(
+        name = "Only import",
+        description = "Comma separated names of the node groups or material to import, along with everything they use (leave empty to import everything)",
+        default = ""
+    )
+    
     assets = PointerProperty(type=AssetList)
     
     asset_types = {
@@ -245,9 +305,14 @@ class BlibThings(bpy.types.PropertyGroup):
             "check_file_func": is_cycles_file,
             "exp_func": export_cycles,
             "imp_func": import_cycles,
-            "exp_props": ["imgi_export", "imge_export", "seq_export", "mov_export", "txti_export", "txte_export", "script_export", "optimize_file"],
+            "exp_session": CyclesExportSession,
+            "bundle_exp_func": export_cycles_bundle,
+            "read_index_func": read_cycles_index,
+            "exp_props": ["imgi_export", "imge_export", "seq_export", "mov_export", "txti_export", "txte_export", "script_export", "optimize_file",
+                           "threads", "compress_level", "text_codec"],
             "imp_props": ["imgi_import", "imge_import", "seq_import", "mov_import", "txti_import", "txte_import",
-                             "script_import", "img_embed", "txt_embed", "img_merge", "resource_path", "skip_sha1"],
+                             "script_import", "img_embed", "txt_embed", "img_merge", "resource_path", "skip_sha1",
+                             "threads"],
             "list_type": "EXPORT_UL_cycles_mat"
         },
         "cycles_grp": {
@@ -257,9 +322,14 @@ class BlibThings(bpy.types.PropertyGroup):
             "check_file_func": is_cycles_file,
             "exp_func": export_cycles,
             "imp_func": import_cycles,
-            "exp_props": ["imgi_export", "imge_export", "seq_export", "mov_export", "txti_export", "txte_export", "script_export", "optimize_file"],
+            "exp_session": CyclesExportSession,
+            "bundle_exp_func": export_cycles_bundle,
+            "read_index_func": read_cycles_index,
+            "exp_props": ["imgi_export", "imge_export", "seq_export", "mov_export", "txti_export", "txte_export", "script_export", "optimize_file",
+                           "threads", "compress_level", "text_codec"],
             "imp_props": ["imgi_import", "imge_import", "seq_import", "mov_import", "txti_import", "txte_import",
-                             "script_import", "img_embed", "txt_embed", "img_merge", "resource_path", "skip_sha1"],
+                             "script_import", "img_embed", "txt_embed", "img_merge", "resource_path", "skip_sha1",
+                             "threads"],
             "list_type": "EXPORT_UL_cycles_grp"
         }
     }